@@ -0,0 +1,229 @@
+"""
+artifactcache - contains a class to reuse stage outputs exactly when the
+    data and parameters that produced them are unchanged
+
+Each result is keyed by a hash of the checksums of the stage's input files
+and of its parameters (beam sizes, mask cutoff, reshape margin, ...). The
+key that produced each output file is kept in a sidecar SQLite manifest, so
+an output made with other parameters is never mistaken for a valid one.
+Copies of outputs are kept in the cache directory under their key, so that
+switching back to earlier parameters restores files instead of recomputing
+them. The least recently used copies are dropped once the cache exceeds its
+size limit.
+
+Requires the following modules: os, shutil, hashlib, sqlite3, threading,
+                                time
+Requires the following files:   workspace.py
+
+Contains the following classes: ArtifactCache
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import time
+import shutil
+import hashlib
+import sqlite3
+import threading
+from workspace import partname
+
+########################## CLASSES ###########################
+
+class ArtifactCache(object):
+    """
+    A size limited, content addressed store of stage outputs
+
+    directory:      directory in which to keep the manifest and copies of
+                    outputs, created if missing
+    maxbytes:       maximum size of stored copies in bytes
+                    (kwarg, default = 20 GB)
+    """
+    def __init__(self,directory,maxbytes=20*2**30):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Stages may run in threads, so share one connection behind a lock
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(os.path.join(directory,'manifest.db'),
+                                    timeout=60,check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS checksums '
+                          '(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                          'sha1 TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS outputs '
+                          '(path TEXT PRIMARY KEY, key TEXT, size INTEGER, '
+                          'mtime REAL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS artifacts '
+                          '(key TEXT PRIMARY KEY, stage TEXT, bytes INTEGER, '
+                          'used REAL)')
+        self.conn.commit()
+
+    def checksum(self,path):
+        """
+        Returns the SHA1 checksum of a file, reusing the stored checksum
+            while the file's size and modification time are unchanged, or
+            None if the file does not exist
+        """
+        if not os.path.isfile(path):
+            return None
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            row = self.conn.execute('SELECT size, mtime, sha1 FROM checksums '
+                                    'WHERE path = ?',[path]).fetchone()
+        if row != None and (row[0],row[1]) == (stat.st_size,stat.st_mtime):
+            return str(row[2])
+        sha = hashlib.sha1()
+        with open(path,'rb') as fobj:
+            for block in iter(lambda: fobj.read(2**20),b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO checksums VALUES '
+                              '(?,?,?,?)',[path,stat.st_size,stat.st_mtime,
+                                           digest])
+            self.conn.commit()
+        return digest
+
+    def key(self,inputs,params):
+        """
+        Hashes a stage's input files and parameters
+
+        inputs:     list of input file paths
+        params:     dictionary of parameters that affect the result,
+                    including a name for the kind of stage
+
+        Returns a hex string
+        """
+        sha = hashlib.sha1()
+        for path in inputs:
+            sha.update(str(self.checksum(path)))
+        for name in sorted(params):
+            sha.update('%s=%r;' % (name,params[name]))
+        return sha.hexdigest()
+
+    def current(self,outputs):
+        """
+        Finds the key that produced a set of output files
+
+        outputs:    list of output file paths
+
+        Returns the key, or None if the outputs were not all made together
+        by a recorded run or have changed since
+        """
+        keys = set()
+        for path in outputs:
+            if not os.path.isfile(path):
+                return None
+            stat = os.stat(path)
+            with self.lock:
+                row = self.conn.execute('SELECT key, size, mtime FROM outputs '
+                                        'WHERE path = ?',
+                                        [os.path.abspath(path)]).fetchone()
+            if row == None or (row[1],row[2]) != (stat.st_size,stat.st_mtime):
+                return None
+            keys.add(str(row[0]))
+        if len(keys) != 1:
+            return None
+        return keys.pop()
+
+    def record(self,key,outputs):
+        """
+        Notes in the manifest that key produced outputs
+        """
+        with self.lock:
+            for path in outputs:
+                if os.path.isfile(path):
+                    stat = os.stat(path)
+                    self.conn.execute('INSERT OR REPLACE INTO outputs VALUES '
+                                      '(?,?,?,?)',[os.path.abspath(path),key,
+                                                   stat.st_size,stat.st_mtime])
+            self.conn.commit()
+
+    def _path(self,key,path):
+        """
+        Returns the path of the stored copy of output path under key
+        """
+        return os.path.join(self.directory,key,os.path.basename(path))
+
+    def store(self,key,stage,outputs):
+        """
+        Records outputs under key and keeps copies of them, then evicts old
+            copies if the cache is over its size limit
+
+        key:        key returned by key()
+        stage:      name of the stage, for reference
+        outputs:    list of output file paths
+
+        Returns nothing explicitly
+        """
+        self.record(key,outputs)
+        keydir = os.path.join(self.directory,key)
+        if not os.path.isdir(keydir):
+            os.makedirs(keydir)
+        nbytes = 0
+        for path in outputs:
+            if os.path.isfile(path):
+                shutil.copy2(path,self._path(key,path))
+                nbytes += os.path.getsize(path)
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO artifacts VALUES '
+                              '(?,?,?,?)',[key,stage,nbytes,time.time()])
+            self.conn.commit()
+        self.evict()
+
+    def restore(self,key,outputs):
+        """
+        Copies stored outputs for key back into place
+
+        key:        key returned by key()
+        outputs:    list of output file paths
+
+        Returns True if every output was restored
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT key FROM artifacts WHERE key = ?',
+                                    [key]).fetchone()
+        if row == None:
+            return False
+        copies = [self._path(key,path) for path in outputs]
+        if not all([os.path.isfile(c) for c in copies]):
+            return False
+        for copy,path in zip(copies,outputs):
+            part = partname(path)
+            shutil.copyfile(copy,part)
+            os.rename(part,path)
+        self.record(key,outputs)
+        with self.lock:
+            self.conn.execute('UPDATE artifacts SET used = ? WHERE key = ?',
+                              [time.time(),key])
+            self.conn.commit()
+        return True
+
+    def evict(self):
+        """
+        Deletes the least recently used copies until the stored copies fit
+            in maxbytes
+
+        Returns nothing explicitly
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT key, bytes FROM artifacts '
+                                     'ORDER BY used DESC').fetchall()
+            total = 0
+            for key,nbytes in rows:
+                total += nbytes
+                if total > self.maxbytes:
+                    shutil.rmtree(os.path.join(self.directory,key),
+                                  ignore_errors=True)
+                    self.conn.execute('DELETE FROM artifacts WHERE key = ?',
+                                      [key])
+            self.conn.commit()
+
+    def close(self):
+        """
+        Closes the manifest database
+        """
+        self.conn.close()
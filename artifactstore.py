@@ -0,0 +1,172 @@
+"""
+artifactstore - contains a class to pass images between pipeline stages in
+    memory, saving them to disk in the background
+
+A stage that makes an image puts it in the store, which keeps the data and
+header in memory for the stages that follow and writes the file in a
+background thread. A stage that needs an image gets it from the store,
+which reads the file only if the image is not already in memory. Images
+that are still to be written are saved before the store lets them go.
+
+Requires the following modules: threading, collections, multiprocessing
+Requires the following files:   frameio.py
+
+Contains the following classes: ArtifactStore
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from frameio import readimage, readheader, writeimage
+
+########################## CLASSES ###########################
+
+class ArtifactStore(object):
+    """
+    Keeps recently made or read images in memory, keyed by path. The least
+        recently used images are dropped once the store holds more than
+        maxbytes of image data.
+
+    maxbytes:       maximum size of image data kept in memory in bytes
+                    (kwarg, default = 2 GB)
+    writers:        number of background threads writing files
+                    (kwarg, default = 1)
+    """
+    def __init__(self,maxbytes=2*2**30,writers=1):
+        self.maxbytes = maxbytes
+        self.images = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.reads = 0
+        self.writes = 0
+        # Path -> number of times it has been put, to tell stages which
+        # outputs they changed
+        self.versions = {}
+        # Path -> AsyncResult of its latest write
+        self.pending = {}
+        self.lock = threading.RLock()
+        self.pool = ThreadPool(writers)
+
+    def put(self,fname,data,header=None,external=False):
+        """
+        Keeps an image in memory and saves it to fname in the background.
+            data must not be modified afterwards.
+
+        fname:      name of file to save
+        data:       image data
+        header:     header to save with the data (kwarg, default = None)
+        external:   if True, the file is read by external programs - see
+                    frameio.writeimage (kwarg, default = False)
+
+        Returns nothing explicitly
+        """
+        if header is not None:
+            header = header.copy()
+        with self.lock:
+            # Writes to the same file must not overlap
+            previous = self.pending.get(fname)
+            if previous != None:
+                previous.get()
+            self._add(fname,(data,header),getattr(data,'nbytes',0))
+            self.versions[fname] = self.versions.get(fname,0)+1
+            self.pending[fname] = self.pool.apply_async(writeimage,
+                                                        (fname,data,header),
+                                                        {'external':external})
+            self.writes += 1
+
+    def get(self,fname):
+        """
+        Returns the data and a copy of the header of the image in fname,
+            reading it if it is not in memory
+        """
+        with self.lock:
+            if fname in self.images:
+                # Move to the most recently used end
+                data,header = self.images.pop(fname)
+                self.images[fname] = (data,header)
+                if header is not None:
+                    header = header.copy()
+                return data,header
+        self.flush([fname])
+        data,header = readimage(fname)
+        with self.lock:
+            self.reads += 1
+            self._add(fname,(data,header),data.nbytes)
+        return data,header.copy()
+
+    def getheader(self,fname):
+        """
+        Returns a copy of the header of the image in fname, reading only the
+            header if the image is not in memory
+        """
+        with self.lock:
+            if fname in self.images and self.images[fname][1] is not None:
+                return self.images[fname][1].copy()
+        self.flush([fname])
+        return readheader(fname)
+
+    def _add(self,fname,image,nbytes):
+        """
+        Stores image under fname, then drops the least recently used images
+            until the store fits in maxbytes
+        """
+        if fname in self.images:
+            self.images.pop(fname)
+            self.nbytes -= self.sizes.pop(fname)
+        self.images[fname] = image
+        self.sizes[fname] = nbytes
+        self.nbytes += nbytes
+        while self.nbytes > self.maxbytes and len(self.images) > 1:
+            oldname,old = self.images.popitem(last=False)
+            self.nbytes -= self.sizes.pop(oldname)
+
+    def version(self,fname):
+        """
+        Returns the number of times fname has been put in the store
+        """
+        return self.versions.get(fname,0)
+
+    def flush(self,fnames=None):
+        """
+        Waits for background writes to finish, raising any error they hit
+
+        fnames:     list of files to wait for - if None, wait for all
+                    (kwarg, default = None)
+
+        Returns nothing explicitly
+        """
+        with self.lock:
+            if fnames == None:
+                fnames = self.pending.keys()
+            results = [(f,self.pending[f]) for f in fnames
+                       if f in self.pending]
+        for fname,result in results:
+            result.get()
+            with self.lock:
+                if self.pending.get(fname) is result:
+                    del self.pending[fname]
+
+    def forget(self,fnames):
+        """
+        Drops images from memory, e.g. after an external program rewrote
+            their files, waiting for their writes first
+        """
+        self.flush(fnames)
+        with self.lock:
+            for fname in fnames:
+                if fname in self.images:
+                    self.images.pop(fname)
+                    self.nbytes -= self.sizes.pop(fname)
+
+    def close(self):
+        """
+        Waits for every background write, then stops the writer threads
+        """
+        try:
+            self.flush()
+        finally:
+            self.pool.close()
+            self.pool.join()
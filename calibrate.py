@@ -0,0 +1,676 @@
+"""
+calibrate - contains functions to dark subtract and flat field individual
+    Dragonfly light frames in-process
+
+Requires the following modules: os, time, shutil, itertools, threading,
+                                collections, multiprocessing, numpy,
+                                astropy, ccdproc
+Requires the following files:   correlate_config.py, headerindex.py,
+                                frameio.py, timing.py, toolrunner.py
+
+Contains the following classes: MasterCache, DirListing
+
+Contains the following functions: masterdarkname, masterflatname, outname,
+                                  readframe, prefetch,
+                                  subtract_dark, divide_flat,
+                                  calibrate_fused, caldirs, splitpath, dircaldirs,
+                                  filecaldirs, movebad, plancalibration,
+                                  printplan, runplan, calibratefiles
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import time
+import shutil
+import itertools
+import threading
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from astropy import units as u
+import ccdproc
+from correlate_config import *
+from headerindex import HeaderIndex
+from frameio import readimage, writeimage
+from timing import span
+from toolrunner import runtool
+
+########################## CLASSES ###########################
+
+class MasterCache(object):
+    """
+    Keeps decoded master frames in memory, keyed by path, so that each master
+        is read once per run. The least recently used frames are dropped
+        once the cache holds more than maxbytes of image data.
+
+    maxbytes:       maximum size of cached image data in bytes
+                    (kwarg, default = 1 GB)
+    """
+    def __init__(self,maxbytes=2**30):
+        self.maxbytes = maxbytes
+        self.frames = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.reads = 0
+
+    def get(self,fname):
+        """
+        Returns the master frame in fname as CCDData, reading it if needed
+        """
+        if fname in self.frames:
+            # Move to the most recently used end
+            frame = self.frames.pop(fname)
+            self.frames[fname] = frame
+            return frame
+        frame = ccdproc.CCDData.read(fname, unit=u.adu)
+        self.reads += 1
+        self._add(fname,frame,frame.data.nbytes)
+        return frame
+
+    def inverse_flat(self,fname):
+        """
+        Returns mean(flat)/flat for the master flat in fname, so that
+            multiplying by it matches ccdproc.flat_correct
+        """
+        key = (fname,'inverse')
+        if key in self.frames:
+            inverse = self.frames.pop(key)
+            self.frames[key] = inverse
+            return inverse
+        flat = self.get(fname).data
+        inverse = flat.mean()/flat.astype(np.float64)
+        self._add(key,inverse,inverse.nbytes)
+        return inverse
+
+    def _add(self,key,frame,nbytes):
+        """
+        Stores frame under key, then drops the least recently used entries
+            until the cache fits in maxbytes
+        """
+        self.frames[key] = frame
+        self.sizes[key] = nbytes
+        self.nbytes += nbytes
+        while self.nbytes > self.maxbytes and len(self.frames) > 1:
+            oldkey,old = self.frames.popitem(last=False)
+            self.nbytes -= self.sizes.pop(oldkey)
+
+    def clear(self):
+        """
+        Drops all cached frames, e.g. after master frames are recreated
+        """
+        self.frames = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+
+# Cache shared by all calibration calls in this process
+mastercache = MasterCache()
+
+class DirListing(object):
+    """
+    Lists each directory once and answers existence checks from memory,
+        so that planning does not touch the filesystem once per product
+    """
+    def __init__(self):
+        self.listings = {}
+
+    def exists(self,path):
+        """
+        Returns True if path was in its directory when the directory was
+            first listed
+        """
+        directory,name = os.path.split(path)
+        if directory not in self.listings:
+            if os.path.isdir(directory):
+                self.listings[directory] = set(os.listdir(directory))
+            else:
+                self.listings[directory] = set()
+        return name in self.listings[directory]
+
+########################## FUNCTIONS ###########################
+
+def masterdarkname(masterdir,serialno,exptime):
+    """
+    Names the master dark for a camera and exposure time
+
+    masterdir:      directory containing master darks
+    serialno:       camera serial number
+    exptime:        exposure time in seconds
+
+    Returns path to the master dark
+    """
+    return masterdir+os.sep+'master_%s_dark_%s.fits' % (serialno,exptime)
+
+def masterflatname(masterdir,serialno):
+    """
+    Names the master flat for a camera
+
+    masterdir:      directory containing master flats
+    serialno:       camera serial number
+
+    Returns path to the master flat
+    """
+    return masterdir+os.sep+'master_%s_flat.fits' % serialno
+
+def outname(fname,outdir,old,new):
+    """
+    Names the output of a calibration stage
+
+    fname:          path to input file
+    outdir:         directory in which to save output
+    old:            part of the file name to replace
+    new:            replacement for old
+
+    Returns path to the output file
+    """
+    short_fname = fname.split(os.sep)[-1]
+    return outdir+os.sep+short_fname.replace(old,new)
+
+def readframe(fname):
+    """
+    Reads a frame as CCDData in ADU
+
+    fname:          path to frame
+
+    Returns CCDData
+    """
+    data,header = readimage(fname)
+    return ccdproc.CCDData(data, meta=header, unit=u.adu)
+
+def prefetch(fnames,depth=2,reader=readframe,stats=None):
+    """
+    Reads frames in background threads while the caller works on the
+        current one, so that file system latency overlaps computation.
+        At most depth frames are read ahead, which caps the memory used.
+
+    fnames:         iterable of paths to frames
+    depth:          number of frames to read ahead - if less than 1, read
+                    each frame only when it is needed (kwarg, default = 2)
+    reader:         function that reads a frame from its path
+                    (kwarg, default = readframe)
+    stats:          dictionary in which to add up the seconds spent reading
+                    frames under 'read', and the seconds the caller waited
+                    for them under 'wait' - if None, do not time
+                    (kwarg, default = None)
+
+    Yields (path, frame) pairs in the order of fnames
+    """
+    fnames = iter(fnames)
+    if stats != None:
+        stats.setdefault('read',0.)
+        stats.setdefault('wait',0.)
+        statlock = threading.Lock()
+        untimed = reader
+        def reader(fname):
+            start = time.time()
+            frame = untimed(fname)
+            with statlock:
+                stats['read'] += time.time()-start
+            return frame
+    if depth < 1:
+        for fname in fnames:
+            start = time.time()
+            frame = reader(fname)
+            if stats != None:
+                stats['wait'] += time.time()-start
+            yield fname,frame
+        return
+    pool = ThreadPool(depth)
+    pending = deque()
+    try:
+        for fname in itertools.islice(fnames,depth):
+            pending.append((fname,pool.apply_async(reader,(fname,))))
+        while pending:
+            fname,result = pending.popleft()
+            start = time.time()
+            frame = result.get()
+            if stats != None:
+                stats['wait'] += time.time()-start
+            # Start the next read before handing this frame over
+            for nextname in itertools.islice(fnames,1):
+                pending.append((nextname,pool.apply_async(reader,(nextname,))))
+            yield fname,frame
+    finally:
+        pool.terminate()
+
+def subtract_dark(fname,masterdir,outdir,verbose=False,cache=mastercache,
+                  image=None):
+    """
+    Subtracts the appropriate master dark from a single frame and saves
+        the result with a _ds suffix. The frame is read once.
+
+    fname:          path to light or flat frame
+    masterdir:      directory containing master darks
+    outdir:         directory in which to save dark subtracted frame
+    verbose:        if True, print progress (kwarg, default = False)
+    cache:          MasterCache from which to take the master dark
+                    (kwarg, default = mastercache)
+    image:          fname already read as CCDData, e.g. by prefetch - if
+                    None, read fname (kwarg, default = None)
+
+    Returns path to dark subtracted frame, or None if the master dark
+    is missing
+    """
+    if image is None:
+        image = readframe(fname)
+    sn = image.header['SERIALNO']
+    exptime = image.header['EXPTIME']
+    full_master = masterdarkname(masterdir,sn,exptime)
+    # Only subtract the master dark if a master dark exists
+    if not os.path.isfile(full_master):
+        return None
+    dark_frame = cache.get(full_master)
+    if verbose:
+        print "--"
+        print "Image: %s" % fname
+        print "Serial number: %s  Exposure time: %s" % (sn,exptime)
+        print "Dark frame is: %s" % full_master
+    ds = ccdproc.subtract_dark(image,
+                               dark_frame,
+                               scale=False,
+                               data_exposure=exptime*u.second,
+                               dark_exposure=exptime*u.second)
+    # Save the result
+    full_outname = outname(fname,outdir,'.fit','_ds.fit')
+    if verbose:
+        print "Saving as: %s" % full_outname
+    writeimage(full_outname,ds.data,ds.header,external=True)
+    return full_outname
+
+def divide_flat(fname,masterdir,outdir,verbose=False,cache=mastercache,
+                image=None):
+    """
+    Divides a single dark subtracted frame by the appropriate master flat,
+        clips it to [0,65536] and saves the result with a _ds_ff suffix.
+        The frame is read once.
+
+    fname:          path to dark subtracted light frame
+    masterdir:      directory containing master flats
+    outdir:         directory in which to save flat fielded frame
+    verbose:        if True, print progress (kwarg, default = False)
+    cache:          MasterCache from which to take the master flat
+                    (kwarg, default = mastercache)
+    image:          fname already read as CCDData, e.g. by prefetch - if
+                    None, read fname (kwarg, default = None)
+
+    Returns path to flat fielded frame, or None if the master flat
+    is missing
+    """
+    if image is None:
+        image = readframe(fname)
+    sn = image.header['SERIALNO']
+    full_master = masterflatname(masterdir,sn)
+    if not os.path.isfile(full_master):
+        return None
+    ff = cache.get(full_master)
+    if verbose:
+        print "--"
+        print "Image: %s" % fname
+        print "Flat:  %s" % full_master
+    flattened_image = ccdproc.flat_correct(image, ff)
+    flattened_image.data = np.clip(flattened_image.data,0.0,65536.0)
+    # Save the result
+    full_outname = outname(fname,outdir,'_ds.fit','_ds_ff.fit')
+    if verbose:
+        print "Saving as: %s" % full_outname
+    writeimage(full_outname,flattened_image.data,flattened_image.header,
+               external=True)
+    return full_outname
+
+def calibrate_fused(fname,darkdir,flatdir,dsdir,ffdir,writeds=True,
+                    verbose=False,cache=mastercache):
+    """
+    Dark subtracts and flat fields a single raw frame in one pass, computing
+        (light - dark)*(mean(flat)/flat) clipped to [0,65536] in place.
+        The result matches subtract_dark followed by divide_flat, without
+        reading the dark subtracted frame back from disk.
+
+    fname:          path to raw light frame
+    darkdir:        directory containing master darks
+    flatdir:        directory containing master flats
+    dsdir:          directory in which to save dark subtracted frame
+    ffdir:          directory in which to save flat fielded frame
+    writeds:        if False, do not save the dark subtracted frame
+                    (kwarg, default = True)
+    verbose:        if True, print progress (kwarg, default = False)
+    cache:          MasterCache from which to take master frames
+                    (kwarg, default = mastercache)
+
+    Returns path to flat fielded frame, or None if a master frame is
+    missing
+    """
+    data,header = readimage(fname)
+    sn = header['SERIALNO']
+    exptime = header['EXPTIME']
+    darkname = masterdarkname(darkdir,sn,exptime)
+    flatname = masterflatname(flatdir,sn)
+    if not os.path.isfile(darkname) or not os.path.isfile(flatname):
+        return None
+    if verbose:
+        print "--"
+        print "Image: %s" % fname
+        print "Dark frame is: %s" % darkname
+        print "Flat:  %s" % flatname
+    calibrated = np.subtract(data,cache.get(darkname).data,dtype=np.float64)
+    del data
+    if writeds:
+        dsname = outname(fname,dsdir,'.fit','_ds.fit')
+        if verbose:
+            print "Saving as: %s" % dsname
+        writeimage(dsname,calibrated,header,external=True)
+    np.multiply(calibrated,cache.inverse_flat(flatname),out=calibrated)
+    np.clip(calibrated,0.0,65536.0,out=calibrated)
+    ffname = outname(fname,ffdir,'.fit','_ds_ff.fit')
+    if verbose:
+        print "Saving as: %s" % ffname
+    writeimage(ffname,calibrated,header,external=True)
+    return ffname
+
+def caldirs(parentdir,cloud,date):
+    """
+    Finds the calibration directories for a cloud on a given date
+
+    parentdir:      directory containing cloud directories
+    cloud:          cloud name
+    date:           date of observation
+
+    Returns a dictionary of directory paths
+    """
+    clouddir = parentdir+'/'+cloud
+    return {'calfiles':clouddir+'/'+config_data['cals']+'/'+date,
+            'rawlights':clouddir+'/'+config_data['raws']+'/'+date,
+            'masterdark':clouddir+'/'+damdir+'/'+date,
+            'masterflat':clouddir+'/'+flmdir+'/'+date,
+            'darksub':clouddir+'/'+dsmdir+'/'+date,
+            'fullcal':clouddir+'/'+config_data['dsff']+'/'+date}
+
+def splitpath(fname):
+    """
+    Breaks up the path to a raw light frame, which should be
+        <parent directory>/<cloud>/<raw directory>/<date>/<file>
+
+    fname:      path to light frame
+
+    Returns parent directory, cloud and date
+    """
+    breakdown = fname.split('/')
+    breakdown.pop(-1)
+    date = breakdown.pop(-1)
+    breakdown.pop(-1)
+    cloud = breakdown.pop(-1)
+    parentdir = '/'.join(breakdown)+'/'
+    return parentdir,cloud,date
+
+def dircaldirs(parentdir,cloud,date):
+    """
+    Lists all raw light frames for a cloud on a given date
+
+    parentdir:      directory containing cloud directories
+    cloud:          cloud name
+    date:           date of observation
+
+    Returns a list of light frames and a list of their calibration
+    directories
+    """
+    dirs = caldirs(parentdir,cloud,date)
+    filelist = os.listdir(dirs['rawlights'])
+    filelist = [dirs['rawlights']+'/'+f for f in filelist
+                if os.path.isfile(dirs['rawlights']+'/'+f)]
+    return filelist,[dirs]*len(filelist)
+
+def filecaldirs(filelist,verbose=False):
+    """
+    Finds calibration directories for each raw light frame in filelist.
+        Frames not in the same parent directory as the first are dropped.
+
+    filelist:       list of paths to raw light frames
+    verbose:        if True, print progress (kwarg, default = False)
+
+    Returns a list of light frames and a list of their calibration
+    directories
+    """
+    parentdir = splitpath(filelist[0])[0]
+    keep = []
+    dirlist = []
+    for f in filelist:
+        newdirectory,cloud,date = splitpath(f)
+        # Confirm that the parent directory is the same as for the first file
+        if newdirectory != parentdir:
+            if verbose:
+                print 'Cannot process '+f+', it is not in '+parentdir
+            continue
+        keep.append(f)
+        dirlist.append(caldirs(parentdir,cloud,date))
+    return keep,dirlist
+
+def movebad(fname,rawlights):
+    """
+    Moves a frame that cannot be calibrated into the bad frames directory
+
+    fname:          path to raw light frame
+    rawlights:      directory containing raw light frames
+
+    Returns nothing explicitly, implicitly moves fname
+    """
+    destination = rawlights+'/'+config_data['badframesdir']
+    if os.path.isfile(destination+'/'+fname.split('/')[-1]):
+        os.remove(destination+'/'+fname.split('/')[-1])
+    shutil.move(fname,destination)
+
+def plancalibration(filelist,dirlist,generate=False,index=None):
+    """
+    Works out which calibration products are missing before anything is
+        made. Each directory is listed once and headers come from the
+        index, so that each light is traced through
+        raw light -> master dark -> dark subtracted flats -> master flat
+        -> fully calibrated frame without spawning a shell.
+
+    filelist:       list of paths to raw light frames
+    dirlist:        list of calibration directory dictionaries, one for
+                    each frame, as returned by caldirs
+    generate:       if True, plan to recreate all calibration products
+                    (kwarg, default = False)
+    index:          HeaderIndex from which to read headers - if None, open
+                    the index named in correlate_config
+                    (kwarg, default = None)
+
+    Returns a dictionary of steps, in the order they must run:
+        'masterdarks':  (master dark directory, calibration directory) pairs
+        'flatds':       (flat, master dark directory, dark subtracted
+                        directory) triples
+        'masterflats':  (master flat directory, dark subtracted directory)
+                        pairs
+        'lights':       (light, calibration directories, calibrated frame)
+                        triples
+        'done':         calibrated frames that already exist
+        'bad':          (light, calibration directories, reason) triples
+                        for lights that cannot be calibrated
+    """
+    if index == None:
+        index = HeaderIndex(config_data['headerindex'])
+    listing = DirListing()
+    plan = {'masterdarks':[],'flatds':[],'masterflats':[],'lights':[],
+            'done':[],'bad':[]}
+    # Products that will exist once the planned steps have run
+    planned = set()
+    # Exposure times of the darks in each calibration directory, per camera
+    darktimes = {}
+    for light,dirs in zip(filelist,dirlist):
+        masterdark = dirs['masterdark']
+        masterflat = dirs['masterflat']
+        darksub = dirs['darksub']
+        calfiles = dirs['calfiles']
+        header = index.header(light)
+        serialno = header['SERIALNO']
+        exptime = header['EXPTIME']
+        if calfiles not in darktimes:
+            darktimes[calfiles] = {}
+            for dark in index.files(calfiles,imagetyp='dark'):
+                dheader = index.header(dark)
+                darktimes[calfiles].setdefault(dheader['SERIALNO'],set()).add(
+                    dheader['EXPTIME'])
+        def havedark(texptime):
+            darkname = masterdarkname(masterdark,serialno,texptime)
+            if darkname in planned:
+                return True
+            exists = listing.exists(darkname)
+            # Master darks are made for every camera and exposure time at once
+            if ((generate or not exists) and
+                texptime in darktimes[calfiles].get(serialno,())):
+                if (masterdark,calfiles) not in plan['masterdarks']:
+                    plan['masterdarks'].append((masterdark,calfiles))
+                planned.add(darkname)
+                return True
+            return exists
+        if not havedark(exptime):
+            plan['bad'].append((light,dirs,'Missing master darks'))
+            continue
+        flatfilelist = index.files(calfiles,serialno=serialno,imagetyp='flat')
+        flatdarks = [flat for flat in flatfilelist
+                     if havedark(index.header(flat)['EXPTIME'])]
+        if flatdarks == []:
+            plan['bad'].append((light,dirs,'Missing master darks for flat field'))
+            continue
+        flatds = [outname(flat,darksub,'.fit','_ds.fit')
+                  for flat in flatfilelist]
+        if not any([f in planned or listing.exists(f) for f in flatds]):
+            for flat in flatdarks:
+                plan['flatds'].append((flat,masterdark,darksub))
+                planned.add(outname(flat,darksub,'.fit','_ds.fit'))
+        flatname = masterflatname(masterflat,serialno)
+        if flatname not in planned and (generate or
+                                        not listing.exists(flatname)):
+            if (masterflat,darksub) not in plan['masterflats']:
+                plan['masterflats'].append((masterflat,darksub))
+            planned.add(flatname)
+        # Named as calibrate_fused names it, for .fit as well as .fits
+        ffname = outname(light,dirs['fullcal'],'.fit','_ds_ff.fit')
+        if generate or not listing.exists(ffname):
+            plan['lights'].append((light,dirs,ffname))
+        else:
+            plan['done'].append(ffname)
+    return plan
+
+def printplan(plan):
+    """
+    Prints the calibration products that plancalibration found missing
+
+    plan:       dictionary returned by plancalibration
+
+    Returns nothing explicitly
+    """
+    print 'Calibration plan:'
+    print '  %d master dark directories to create' % len(plan['masterdarks'])
+    for masterdark,calfiles in plan['masterdarks']:
+        print '    '+masterdark+' from '+calfiles
+    print '  %d flats to dark subtract' % len(plan['flatds'])
+    for flat,masterdark,darksub in plan['flatds']:
+        print '    '+flat
+    print '  %d master flat directories to create' % len(plan['masterflats'])
+    for masterflat,darksub in plan['masterflats']:
+        print '    '+masterflat+' from '+darksub
+    print '  %d lights to calibrate' % len(plan['lights'])
+    for light,dirs,ffname in plan['lights']:
+        print '    '+ffname
+    print '  %d lights already calibrated' % len(plan['done'])
+    print '  %d lights that cannot be calibrated' % len(plan['bad'])
+    for light,dirs,reason in plan['bad']:
+        print '    '+light+': '+reason
+
+def runplan(plan,verbose=False,nointermediate=False):
+    """
+    Makes the calibration products listed in a plan, in dependency order.
+        Master frames are made once per directory. Frames that cannot be
+        calibrated are moved to the bad frames directory.
+
+    plan:           dictionary returned by plancalibration
+    verbose:        if True, print progress (kwarg, default = False)
+    nointermediate: if True, do not save dark subtracted lights - dark
+                    subtracted flats are always saved, as master flats
+                    are made from them (kwarg, default = False)
+
+    Returns a list of paths to fully calibrated frames
+    """
+    badframesdir = config_data['badframesdir']
+    dirlist = [dirs for light,dirs,ffname in plan['lights']]
+    dirlist += [dirs for light,dirs,reason in plan['bad']]
+    if verbose:
+        print 'If calibration output directories do not exist, create them.'
+    for dirs in dirlist:
+        for key in ['masterdark','masterflat','darksub','fullcal']:
+            if not os.path.isdir(dirs[key]):
+                os.makedirs(dirs[key])
+        if not os.path.isdir(dirs['rawlights']+'/'+badframesdir):
+            os.makedirs(dirs['rawlights']+'/'+badframesdir)
+    for masterdark,calfiles in plan['masterdarks']:
+        if verbose:
+            print 'Creating master darks in '+masterdark
+        runtool('./create_masterdarks -v -i '+config_data['headerindex']+
+               ' -o '+masterdark+' '+calfiles)
+    for flat,masterdark,darksub in plan['flatds']:
+        with span('subtract_dark',frame=os.path.basename(flat)):
+            subtract_dark(flat,masterdark,darksub,verbose=verbose)
+    for masterflat,darksub in plan['masterflats']:
+        if verbose:
+            print 'Creating master flats in '+masterflat
+        runtool('./create_masterflats -v -i '+config_data['headerindex']+
+               ' -o '+masterflat+' '+darksub)
+    if plan['masterdarks'] != [] or plan['masterflats'] != []:
+        mastercache.clear()
+    for light,dirs,reason in plan['bad']:
+        if verbose:
+            print reason+' for image '+light+', skipping.'
+        movebad(light,dirs['rawlights'])
+    calibrated = list(plan['done'])
+    for light,dirs,ffname in plan['lights']:
+        if verbose:
+            print 'Creating fully calibrated image for '+light
+        with span('calibrate_fused',frame=os.path.basename(light)):
+            result = calibrate_fused(light,dirs['masterdark'],
+                                     dirs['masterflat'],dirs['darksub'],
+                                     dirs['fullcal'],
+                                     writeds=not nointermediate,
+                                     verbose=verbose)
+        if result == None or not os.path.isfile(ffname):
+            if verbose:
+                print 'Missing calibrated images for '+light
+            movebad(light,dirs['rawlights'])
+            continue
+        calibrated.append(ffname)
+    return calibrated
+
+def calibratefiles(filelist,dirlist,generate=False,verbose=False,index=None,
+                   nointermediate=False,dryrun=False):
+    """
+    Dark subtracts and flat fields raw light frames. The missing calibration
+        products are planned up front by plancalibration and then made by
+        runplan, so master frames and dark subtracted flats are created
+        once per directory (and only if missing, unless generate is True).
+        Lights are calibrated in a single pass by calibrate_fused. Frames
+        that cannot be calibrated are moved to the bad frames directory.
+
+    filelist:       list of paths to raw light frames
+    dirlist:        list of calibration directory dictionaries, one for
+                    each frame, as returned by caldirs
+    generate:       if True, recreate all calibration products
+                    (kwarg, default = False)
+    verbose:        if True, print progress and the plan
+                    (kwarg, default = False)
+    index:          HeaderIndex from which to read headers - if None, open
+                    the index named in correlate_config
+                    (kwarg, default = None)
+    nointermediate: if True, do not save dark subtracted lights - dark
+                    subtracted flats are always saved, as master flats
+                    are made from them (kwarg, default = False)
+    dryrun:         if True, print the plan without making anything
+                    (kwarg, default = False)
+
+    Returns a list of paths to fully calibrated frames
+    """
+    plan = plancalibration(filelist,dirlist,generate=generate,index=index)
+    if verbose or dryrun:
+        printplan(plan)
+    if dryrun:
+        return plan['done']
+    return runplan(plan,verbose=verbose,nointermediate=nointermediate)
@@ -3,6 +3,7 @@
 callastrometry - contains functions to handle WCS header information
 
 Requires the following modules: os, docopt, astropy
+Requires the following files:   frameio.py, toolrunner.py
 
 Contains the following functions: callastrometry, scrubwcsheader
 
@@ -12,6 +13,8 @@ Contains the following functions: callastrometry, scrubwcsheader
 import os
 from astropy import wcs
 from astropy.io import fits
+from frameio import imageext, readimage, writeimage
+from toolrunner import runtool
 
 ########################## DATA LISTS ###########################
 
@@ -42,9 +45,15 @@ def callastrometry(fname,generate=False,filekeep=False):
         print 'Astrometry already done'
     # Otherwise, do astrometry
     else:
-        # Run astrometry.net
+        # Run astrometry.net, pointing it at the image extension if the
+        # file is tile compressed
+        hdulist = fits.open(fname)
+        ext = imageext(hdulist)
+        hdulist.close()
         command = 'solve-field --no-fits2fits --use-sextractor --cpulimit 20 {0}'.format(fname)
-        os.system(command)
+        if ext > 0:
+            command += ' --extension {0}'.format(ext)
+        runtool(command,frame=os.path.basename(fname))
         trimfname = fname.split('.fits')[0]
         if filekeep == False:
             for ext in fileextensions:
@@ -55,14 +64,14 @@ def callastrometry(fname,generate=False,filekeep=False):
         # Get x,y pixel scales
         scales = wcs.utils.proj_plane_pixel_scales(w)*3600
         # Read in file data
-        data,light = fits.getdata(fname,header=True)
+        data,light = readimage(fname)
         # Update header
         light['PSCALY']=scales[0]
         light['PSCALX']=scales[1]
         for key in keys:
             light[key] = lightwcs[key]
         # Save updated file
-        fits.writeto(fname,data,light,clobber=True)
+        writeimage(fname,data,light,external=True)
         if filekeep == False:
             os.system('rm -f '+trimfname+'.wcs')
 
@@ -3,7 +3,7 @@
 """check_apassoverlap -- Plot the overlapping stars in the APASS catalog and an input image with wcs; specific catalog columns are needed.  :
 
 Usage:  
-    check_apassoverlap [-h] [-v] [-c] [-t THREASHOLD] [-e ARCSEC] [-s SEXLOCATION] [-r DIRECTORY] (save | show) <image>
+    check_apassoverlap [-h] [-v] [-c] [-t THREASHOLD] [-e ARCSEC] [-s SEXLOCATION] [-r DIRECTORY] [-w DIRECTORY] (save | show) <image>
 
 Options:
     -h, --help                              Show this screen
@@ -13,6 +13,7 @@ Options:
     -e ARCSEC, --error=ARCSEC               Maximum allowable separation in arcsec [default: 1.5]
     -s SEXLOCATION, --sex SEXLOCATION       Location of SExtractor executable [default: /opt/local/bin/sex]
     -r DIRECTORY, --refcat DIRECTORY        The directory containing the reference APASS catalogs [default: /Volumes/dragonfly/data/dragonflysurvey/APASS]
+    -w DIRECTORY, --workspace DIRECTORY     Directory for scratch files and the APASS cache [default: .]
 
 Examples:
     python check_apassoverlap.py -v save input.fits
@@ -28,6 +29,7 @@ import os
 import pandas as pd
 import numpy
 from scipy import spatial
+from sexmanager import runsex
 
 def print_verbose_string(printme):
     # Print information to standard error
@@ -176,6 +178,7 @@ THETA_SKY
 ISOAREA_IMAGE
 FWHM_IMAGE
 ISOAREAF_IMAGE
+ELLIPTICITY
 """
 
 default_conv = """CONV NORM
@@ -215,13 +218,13 @@ default_nnw = """NNW
  1.00000e+00 
 """
 
-def create_catalog(image_name, detect_thresh=10):
+def create_catalog(image_name, detect_thresh=10, workspace='.'):
     # Create a config, param, conv, nnw file for Sextractor
-    sextractor_config_name = "scamp.sex"
-    params_name = "scamp.param"
-    nnw_name = "default.nnw"
-    conv_name = "default.conv"
-    catalog_name = "cz.cat"
+    sextractor_config_name = os.path.join(workspace,"scamp.sex")
+    params_name = os.path.join(workspace,"scamp.param")
+    nnw_name = os.path.join(workspace,"default.nnw")
+    conv_name = os.path.join(workspace,"default.conv")
+    catalog_name = os.path.join(workspace,"cz.cat")
     if verbose:
         verbose_type = "NORMAL"
     else:
@@ -245,15 +248,16 @@ def create_catalog(image_name, detect_thresh=10):
                 format(config=sextractor_config_name, catalog=catalog_name, image=image_name)
                 )
     # Run SExtractor command
-    subprocess.call(sex_loc+" -c {config} -CATALOG_NAME {catalog} {image}".format(config=sextractor_config_name, catalog=catalog_name, image=image_name), shell=True)
+    # Run SExtractor, or reuse an earlier run with the same image and settings
+    runsex(image_name, catalog_name, config=sextractor_config_name, sex=sex_loc, frame=os.path.basename(image_name))
     return catalog_name
 
-def remove_tmpfiles():
-    sextractor_config_name = "scamp.sex"
-    params_name = "scamp.param"
-    nnw_name = "default.nnw"
-    conv_name = "default.conv"
-    catalog_name = "cz.cat"
+def remove_tmpfiles(workspace='.'):
+    sextractor_config_name = os.path.join(workspace,"scamp.sex")
+    params_name = os.path.join(workspace,"scamp.param")
+    nnw_name = os.path.join(workspace,"default.nnw")
+    conv_name = os.path.join(workspace,"default.conv")
+    catalog_name = os.path.join(workspace,"cz.cat")
     os.remove(sextractor_config_name)
     os.remove(params_name)
     os.remove(nnw_name)
@@ -286,6 +290,8 @@ if __name__ == "__main__":
     sex_loc         = arguments['--sex']
     apass_dir = arguments['--refcat']
     apass_dir = apass_dir + '/'
+    workspace = arguments['--workspace']
+    apass_cache = os.path.join(workspace,'apass_cache.dat')
 
     if verbose:
         print arguments
@@ -299,7 +305,7 @@ if __name__ == "__main__":
 
     if re.search('.cat$', image) == None:
         # Need to run SExtractor to generate the catalog
-        cat = create_catalog(image,detect_thresh=detect_sigma)
+        cat = create_catalog(image,detect_thresh=detect_sigma,workspace=workspace)
     else:
         # The catalog is just the input image file
         cat = image
@@ -332,8 +338,8 @@ if __name__ == "__main__":
         print_verbose_string( "Min declination: %f" % min_dec )
         print_verbose_string( "Max declination: %f" % max_dec ) 
 
-    if cache and os.path.isfile('apass_cache.dat'):
-        (name,ra,dec,g,r,gerr,rerr) = numpy.loadtxt('apass_cache.dat')
+    if cache and os.path.isfile(apass_cache):
+        (name,ra,dec,g,r,gerr,rerr) = numpy.loadtxt(apass_cache)
         if verbose:
             print_verbose_string( "Loading cached catalog data" )
     else:
@@ -353,7 +359,7 @@ if __name__ == "__main__":
             gerr = numpy.concatenate( (gerr,gerr_extra) )
             rerr = numpy.concatenate( (rerr, rerr_extra) )
         if cache:
-            numpy.savetxt('apass_cache.dat',(name,ra,dec,g,r,gerr,rerr))
+            numpy.savetxt(apass_cache,(name,ra,dec,g,r,gerr,rerr))
 
     # Extract RA and DECS from image cat and APASS cat
     DragonflyRADec = [x_world,y_world]
@@ -470,5 +476,5 @@ if __name__ == "__main__":
     
 
 # Clean up by removing all tmp files
-    #remove_tmpfiles()
+    #remove_tmpfiles(workspace)
 
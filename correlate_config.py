@@ -18,6 +18,19 @@ config_data = {
 	'dsff':'/darksub_flatfield/', # name of calibrated file directory (will be created)
 	'rwcorrfiles':False, # rewrites files to be correlated against (Herschel specific)
 	'badframesdir':'/removedframes', # place to put bad files
+	'headerindex':'headerindex.db', # persistent index of FITS headers (will be created)
+	'outputformat':'float64', # format of saved stage images (float64/float32/rice)
+	'quantize':16, # Rice quantization level, as a fraction of the noise in each tile
+	'artifactcache':'artifactcache/', # cache of correlate stage outputs, keyed by their inputs and parameters (will be created)
+	'cachesize':20, # maximum size of the artifact cache in GB
+	'sexcache':'sexcache/', # cache of SExtractor catalogues and check images, keyed by image and configuration (will be created)
+	'sexcachesize':10, # maximum size of the SExtractor cache in GB
+	'tracedir':'traces/', # directory of per-run timing traces (will be created) - if empty, do not save timings
+	'toollogs':'toollogs/', # directory of per-run logs of external programs, one per frame (will be created) - if empty, print their output
+	'toolslots':{'solve-field':4,'sex':4,'scamp':2,'swarp':2}, # maximum runs of each external program at once per process - unlisted programs get one per CPU
+	'regridmemory':256, # approximate memory in MB used for coordinates by each regrid at once, which processes the target grid in tiles of rows to fit
+	'regridtolerance':0, # largest error in pixels allowed when approximating the pixel mapping between frame and Herschel grids from a sparse control grid - if zero, always use the exact mapping
+	'regridplans':'regridplans/', # directory of saved pixel mappings between frame and Herschel grids (will be created) - if empty, keep them in memory only
 	'cutoff_type':'median', # rule to apply to data to calculate cutoff (median/mean)
 	'cutoff_mult':10, # multiplicative factor to apply to cutoff
 	'cutoff':0 # if zero, multiplies cutoff_mult by cutoff_type(data) to calculate cutoff - otherwise hard cutoff			
@@ -2,7 +2,7 @@
 
 """create_photometriclights.py -- based on APASS catalog, flatten light frames. 
 
-Usage: create_photometriclights [-h] [-v] [-c] [-p] [-u] [-m NUMBER] [-x NUMBER] [-t NUMBER] [-e ARCSEC] [-d SIGMA] [-f FILTER] [-r DIRECTORY] [-s LOCATION] [-o DIRECTORY] [-i DIRECTORY] [-k] [-l] [-n] <image>
+Usage: create_photometriclights [-h] [-v] [-c] [-p] [-u] [-m NUMBER] [-x NUMBER] [-t NUMBER] [-e ARCSEC] [-d SIGMA] [-f FILTER] [-r DIRECTORY] [-s LOCATION] [-o DIRECTORY] [-i DIRECTORY] [-w DIRECTORY] [-k] [-l] [-n] <image>
 
 Options:
     -h, --help                                  Show this screen
@@ -20,6 +20,7 @@ Options:
     -s LOCATION, --sex LOCATION                 Location of SExtractor executable [default: /opt/local/bin/sex]
     -o DIRECTORY, --outputdir DIRECTORY         Output directory name  [default: .]
     -i DIRECTORY, --inspectdir DIRECTORY        Output directory for photometry models for inspection
+    -w DIRECTORY, --workspace DIRECTORY         Directory for scratch files and the APASS cache [default: tmp]
     -k, --kfit                                  Correct for the colour term 
     -l, --planefit                              Fit a plane to zeropoint residue and divide it out
     -n, --vinettefit                            Fit a radial profile to zeropoint residue with centre of profile as free variable
@@ -74,6 +75,9 @@ from astropy.modeling import models, fitting
 
 from scipy.optimize import curve_fit
 
+from workspace import partname
+from sexmanager import runsex
+
 def print_verbose_string(printme):
     print >> sys.stderr, "VERBOSE: %s" % printme
 
@@ -320,14 +324,14 @@ default_nnw = """NNW
 """
 
 
-def create_catalog(image_name, detect_thresh=10):
+def create_catalog(image_name, detect_thresh=10, workspace='tmp'):
 
     # Create a config, param, conv, nnw file for Sextractor
-    sextractor_config_name = "tmp/scamp.sex"
-    params_name = "tmp/scamp.param"
-    nnw_name = "tmp/default.nnw"
-    conv_name = "tmp/default.conv"
-    catalog_name = "tmp/cz.cat"
+    sextractor_config_name = os.path.join(workspace,"scamp.sex")
+    params_name = os.path.join(workspace,"scamp.param")
+    nnw_name = os.path.join(workspace,"default.nnw")
+    conv_name = os.path.join(workspace,"default.conv")
+    catalog_name = os.path.join(workspace,"cz.cat")
     if verbose:
         verbose_type = "NORMAL"
     else:
@@ -345,10 +349,10 @@ def create_catalog(image_name, detect_thresh=10):
     fp = open(nnw_name, "w")
     fp.write(default_nnw)
     fp.close()
-    
-    backname         = image_name.split('.')[0]+'_miniback.fits'
-    filteredbackname = image_name.split('.')[0]+'_filteredback.fits'
-    subprocess.call(sex_loc+" -c {config} -CATALOG_NAME {catalog} -CHECKIMAGE_NAME '{back_name} {filteredback_name}' {image}".format(config=sextractor_config_name, catalog=catalog_name, back_name=backname, filteredback_name=filteredbackname, image=image_name), shell=True)
+
+    # Run SExtractor, or reuse an earlier run with the same image and settings.
+    # The configuration sets no check image type, so none are requested.
+    runsex(image_name, catalog_name, config=sextractor_config_name, sex=sex_loc, frame=os.path.basename(image_name))
 
     return catalog_name
 
@@ -412,9 +416,12 @@ def save_image(image, factor_map, newimage_dir, inspect_dir, suffix='pc'):
     image_basename  = image.split('/')[-1]
     image_basename  = image_basename.split('.')[-2]
     new_image_name  = newimage_dir + '/' + image_basename + '_'+suffix +'.fits' 
-    if os.path.exists(new_image_name):
-        os.remove(new_image_name)
-    hdulist_final.writeto(new_image_name)
+    # Write next to the final name and rename, so it is never seen half written
+    part = partname(new_image_name)
+    if os.path.exists(part):
+        os.remove(part)
+    hdulist_final.writeto(part)
+    os.rename(part,new_image_name)
 
     if inspect_dir:
         basename    = image.split('/')[-1]
@@ -504,6 +511,10 @@ if __name__ == "__main__":
 
     apass_dir = arguments['--refcat']
     apass_dir = apass_dir + '/'
+    workspace = arguments['--workspace']
+    if not os.path.isdir(workspace):
+        os.makedirs(workspace)
+    apass_cache = os.path.join(workspace,'apass_cache.dat')
 
     if verbose:
         print arguments
@@ -515,7 +526,7 @@ if __name__ == "__main__":
     if re.search('.fits$', inputfits):
         # Need to run SExtractor to generate the catalog
         band = determine_filter(inputfits,band)
-        cat = create_catalog(inputfits,detect_thresh=detect_sigma)
+        cat = create_catalog(inputfits,detect_thresh=detect_sigma,workspace=workspace)
 
     #Load catalog data 
     #(number, flux_auto, fluxerr_auto, fluxerr_aper, x_image, y_image, flux_radius, flags, class_star)
@@ -554,8 +565,8 @@ if __name__ == "__main__":
         print_verbose_string( "Max declination: %f" % max_dec )
 
     # Load the AAVSO APASS catalog, either from the cache (fast) or from the original files (slow). 
-    if cache and os.path.isfile('apass_cache.dat'):
-        (name,ra,dec,g,r,gerr,rerr) = numpy.loadtxt('apass_cache.dat')
+    if cache and os.path.isfile(apass_cache):
+        (name,ra,dec,g,r,gerr,rerr) = numpy.loadtxt(apass_cache)
         if verbose:
             print_verbose_string( "Loading cached catalog data" )
     else:
@@ -577,7 +588,7 @@ if __name__ == "__main__":
             gerr= numpy.concatenate( (gerr, gerr_extra) )
             rerr= numpy.concatenate( (rerr, rerr_extra) )
         if cache:
-            numpy.savetxt('apass_cache.dat',(name,ra,dec,g,r,gerr,rerr))
+            numpy.savetxt(apass_cache,(name,ra,dec,g,r,gerr,rerr))
     
     # Select the magnitude corresponding to the known filter. If a sum of g and r
     # is being used then guesstimate the summed magnitude.
@@ -934,7 +945,9 @@ if __name__ == "__main__":
             header['C0']=(c0, 'Dragonfly Pipeline')
             header['C1']=(c1, 'Dragonfly Pipeline')
             header['RSQ4']=(Rsq4, 'Dragonfly Pipeline')            
-        fits.writeto(new_image,data,header,clobber=True) 
+        part = partname(new_image)
+        fits.writeto(part,data,header,clobber=True)
+        os.rename(part,new_image)
 
 # Optionally plot the results
     
@@ -0,0 +1,163 @@
+"""
+frameio - contains functions to save images in a selectable output format
+    and to read them back whichever format they were saved in
+
+Output formats:
+    float64     uncompressed 64-bit floats, as written by fits.writeto
+    float32     uncompressed 32-bit floats, half the size of float64
+    rice        Rice tile-compressed 32-bit floats in a CompImageHDU,
+                quantized to 1/quantize of the noise in each tile
+
+Rice compressed images are stored in the first extension. The image header
+is also copied into the otherwise empty primary HDU, so that fits.getheader
+and the header index still find SERIALNO, EXPTIME, WCS and so on. Images
+read by external programs or helper scripts, e.g. SExtractor, SCAMP, SWarp
+or ccdproc, are written with external=True: those programs only read the
+primary HDU, so such images are saved as float32 instead of rice.
+
+Requires the following modules: numpy, astropy
+Requires the following files:   correlate_config.py, workspace.py
+
+Contains the following functions: setformat, imageext, writeimage,
+                                  readimage, readheader
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import numpy as np
+from astropy.io import fits
+from correlate_config import *
+from workspace import partname
+
+########################## DATA LISTS ###########################
+
+# Recognised output formats
+formats = ['float64','float32','rice']
+# Header keywords that describe the data layout rather than the image
+structural = ['SIMPLE','XTENSION','BITPIX','NAXIS','NAXIS1','NAXIS2','EXTEND',
+              'PCOUNT','GCOUNT','BSCALE','BZERO']
+
+# Format used when a writer is not told otherwise
+policy = {'format':config_data['outputformat'],
+          'quantize':config_data['quantize']}
+
+########################## FUNCTIONS ###########################
+
+def setformat(format=None,quantize=None):
+    """
+    Changes the output format used by every stage writer in this process
+
+    format:         one of formats - if None, leave unchanged
+                    (kwarg, default = None)
+    quantize:       Rice quantization level - if None, leave unchanged
+                    (kwarg, default = None)
+
+    Returns nothing explicitly
+    """
+    if format != None:
+        if format not in formats:
+            raise ValueError('Unknown output format '+format)
+        policy['format'] = format
+    if quantize != None:
+        policy['quantize'] = float(quantize)
+
+def imageext(hdulist):
+    """
+    Finds the first HDU in hdulist that holds image data
+
+    hdulist:        open fits.HDUList
+
+    Returns the index of the HDU
+    """
+    for i,hdu in enumerate(hdulist):
+        if hdu.header.get('NAXIS',0) > 0 or isinstance(hdu,fits.CompImageHDU):
+            return i
+    return 0
+
+def writeimage(fname,data,header=None,format=None,quantize=None,
+               external=False):
+    """
+    Saves an image in the chosen output format, atomically replacing any
+        existing file
+
+    fname:          name of file to save
+    data:           image data
+    header:         header to save with the data (kwarg, default = None)
+    format:         one of formats - if None, use the format set by
+                    setformat or correlate_config (kwarg, default = None)
+    quantize:       Rice quantization level - if None, use the level set
+                    by setformat or correlate_config (kwarg, default = None)
+    external:       if True, the image is read by programs that only read
+                    the primary HDU, so save rice as float32
+                    (kwarg, default = False)
+
+    Returns nothing explicitly, implicitly saves fname
+    """
+    if format == None:
+        format = policy['format']
+    if quantize == None:
+        quantize = policy['quantize']
+    if format not in formats:
+        raise ValueError('Unknown output format '+format)
+    if external and format == 'rice':
+        format = 'float32'
+    data = np.asarray(data)
+    if format != 'float64':
+        data = data.astype(np.float32)
+    if header is not None:
+        header = header.copy()
+        for key in ['BSCALE','BZERO']:
+            if key in header:
+                del header[key]
+    if format == 'rice':
+        primaryheader = fits.Header()
+        if header is not None:
+            for card in header.cards:
+                if card.keyword not in structural:
+                    primaryheader.append(card)
+        hdulist = fits.HDUList([fits.PrimaryHDU(header=primaryheader),
+                                fits.CompImageHDU(data=data,header=header,
+                                                  compression_type='RICE_1',
+                                                  quantize_level=quantize)])
+    else:
+        hdulist = fits.HDUList([fits.PrimaryHDU(data=data,header=header)])
+    # Write next to fname and rename, so fname is never seen half written
+    part = partname(fname)
+    if os.path.exists(part):
+        os.remove(part)
+    hdulist.writeto(part)
+    os.rename(part,fname)
+
+def readimage(fname):
+    """
+    Reads an image saved in any of the output formats
+
+    fname:          name of file to read
+
+    Returns image data and header
+    """
+    hdulist = fits.open(fname,memmap=False)
+    try:
+        hdu = hdulist[imageext(hdulist)]
+        data = hdu.data
+        header = hdu.header.copy()
+    finally:
+        hdulist.close()
+    return data,header
+
+def readheader(fname):
+    """
+    Reads the image header of a file saved in any of the output formats
+
+    fname:          name of file to read
+
+    Returns header
+    """
+    hdulist = fits.open(fname)
+    try:
+        header = hdulist[imageext(hdulist)].header.copy()
+    finally:
+        hdulist.close()
+    return header
@@ -0,0 +1,171 @@
+"""
+headerindex - contains a class to keep a persistent index of FITS headers,
+    so that directories are not rescanned every time a script runs
+
+Requires the following modules: os, sqlite3, astropy
+
+Contains the following classes: HeaderIndex
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import sqlite3
+from astropy.io import fits
+
+########################## DATA LISTS ###########################
+
+# Extensions of files to index
+extensions = ('.fit','.fits','.fts','.fit.gz','.fits.gz','.fts.gz')
+# Header keywords that can be queried, stored in their own columns
+keywords = ['SERIALNO','IMAGETYP','EXPTIME','FILTNAM','DATE']
+
+########################## CLASSES ###########################
+
+class HeaderIndex(object):
+    """
+    An on-disk SQLite index of FITS headers. Each file is keyed by its path,
+        size and modification time, and its header is only read again when
+        the file changes.
+
+    dbname:     path to the index database, created if missing
+                (kwarg, default = 'headerindex.db')
+    """
+    def __init__(self,dbname='headerindex.db'):
+        self.dbname = dbname
+        self.conn = sqlite3.connect(dbname,timeout=60)
+        # EXPTIME has no declared type so that integers and floats keep
+        # the type they have in the header
+        self.conn.execute('CREATE TABLE IF NOT EXISTS headers '
+                          '(path TEXT PRIMARY KEY, directory TEXT, '
+                          'size INTEGER, mtime REAL, serialno TEXT, '
+                          'imagetyp TEXT, exptime, filtnam TEXT, date TEXT, '
+                          'header TEXT)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS headers_directory '
+                          'ON headers (directory)')
+        self.conn.commit()
+        # Directories brought up to date by this instance
+        self.updated = set()
+
+    def _store(self,path,stat):
+        """
+        Reads the header of path and stores it in the index
+        """
+        header = fits.getheader(path)
+        values = [header.get(key) for key in keywords]
+        self.conn.execute('INSERT OR REPLACE INTO headers VALUES '
+                          '(?,?,?,?,?,?,?,?,?,?)',
+                          [path,os.path.dirname(path),stat.st_size,
+                           stat.st_mtime]+values+[header.tostring()])
+
+    def update(self,directory):
+        """
+        Brings the index up to date for the FITS files in directory, reading
+            only headers of new or modified files and forgetting deleted ones
+
+        directory:      directory to index
+
+        Returns nothing explicitly
+        """
+        directory = os.path.abspath(directory)
+        known = {}
+        for path,size,mtime in self.conn.execute(
+                'SELECT path, size, mtime FROM headers WHERE directory = ?',
+                [directory]):
+            known[path] = (size,mtime)
+        for name in os.listdir(directory):
+            if not name.lower().endswith(extensions):
+                continue
+            path = os.path.join(directory,name)
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            if known.pop(path,None) != (stat.st_size,stat.st_mtime):
+                self._store(path,stat)
+        # Anything left over no longer exists
+        for path in known:
+            self.conn.execute('DELETE FROM headers WHERE path = ?',[path])
+        self.conn.commit()
+        self.updated.add(directory)
+
+    def _refresh(self,directory):
+        """
+        Updates directory if this instance has not done so already, and
+            returns its absolute path
+        """
+        directory = os.path.abspath(directory)
+        if directory not in self.updated:
+            self.update(directory)
+        return directory
+
+    def header(self,path):
+        """
+        Returns the header of path as a fits.Header, reading the file only if
+            it is not indexed or has changed since it was indexed
+
+        path:       path to FITS file
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.conn.execute('SELECT size, mtime, header FROM headers '
+                                'WHERE path = ?',[path]).fetchone()
+        if row is None or (row[0],row[1]) != (stat.st_size,stat.st_mtime):
+            self._store(path,stat)
+            self.conn.commit()
+            row = self.conn.execute('SELECT size, mtime, header FROM headers '
+                                    'WHERE path = ?',[path]).fetchone()
+        return fits.Header.fromstring(row[2])
+
+    def files(self,directory,**kwd):
+        """
+        Lists FITS files in directory whose headers match all the keywords
+            given, e.g. files(d,serialno='83F010687',imagetyp='light').
+            IMAGETYP is matched without regard to case.
+
+        directory:      directory to search
+        kwd:            any of serialno, imagetyp, exptime, filtnam, date
+
+        Returns a sorted list of paths
+        """
+        query = 'SELECT path FROM headers WHERE directory = ?'
+        args = [self._refresh(directory)]
+        for key,value in sorted(kwd.items()):
+            if key.upper() not in keywords:
+                raise KeyError('Cannot query on '+key)
+            if key.lower() == 'imagetyp':
+                query += ' AND lower(imagetyp) = lower(?)'
+            else:
+                query += ' AND {0} = ?'.format(key.lower())
+            args.append(value)
+        query += ' ORDER BY path'
+        return [str(row[0]) for row in self.conn.execute(query,args)]
+
+    def values(self,directory,key,unique=False):
+        """
+        Lists the values of a header keyword for FITS files in directory
+
+        directory:      directory to search
+        key:            any of serialno, imagetyp, exptime, filtnam, date
+        unique:         if True, list each value only once
+                        (kwarg, default = False)
+
+        Returns a list of values, ordered by path or, if unique, by value
+        """
+        if key.upper() not in keywords:
+            raise KeyError('Cannot query on '+key)
+        if unique:
+            query = ('SELECT DISTINCT {0} FROM headers WHERE directory = ? '
+                     'AND {0} IS NOT NULL ORDER BY {0}')
+        else:
+            query = 'SELECT {0} FROM headers WHERE directory = ? ORDER BY path'
+        rows = self.conn.execute(query.format(key.lower()),
+                                 [self._refresh(directory)])
+        values = [row[0] for row in rows]
+        return [str(v) if isinstance(v,unicode) else v for v in values]
+
+    def close(self):
+        """
+        Closes the index database
+        """
+        self.conn.close()
@@ -0,0 +1,136 @@
+"""
+herschelmaps - contains classes to load each Herschel SPIRE map once and
+    share it between every frame correlated against it
+
+A map is read once per cloud, converted to MJy/sr if it is not already,
+and kept with its WCS solution. The image data lives in shared memory that
+is read-only to numpy, so worker processes forked after the maps are loaded
+use the parent's copy instead of reading and holding their own.
+
+Requires the following modules: os, ctypes, multiprocessing, numpy, astropy
+Requires the following files:   correlate_config.py
+
+Contains the following functions: sharedarray
+
+Contains the following classes: HerschelMap, HerschelRegistry
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import ctypes
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+from astropy.io import fits
+from astropy import wcs
+from correlate_config import *
+
+########################## DATA LISTS ###########################
+
+# Factors to convert raw Herschel units to MJy/sr, from
+# http://herschel.esac.esa.int/Docs/SPIRE/html/spire_om.html
+K_PtoE = {'PSW':91.289,'PMW':51.799,'PLW':24.039}
+# SPIRE band for each wavelength in microns
+codewavelength = {250:'PSW',350:'PMW',500:'PLW'}
+
+########################## FUNCTIONS ###########################
+
+def sharedarray(arr):
+    """
+    Copies an array into shared memory that forked processes inherit
+
+    arr:        numpy array
+
+    Returns a read-only numpy array backed by shared memory
+    """
+    arr = np.ascontiguousarray(arr)
+    raw = RawArray(ctypes.c_char,max(arr.nbytes,1))
+    shared = np.frombuffer(raw,dtype=arr.dtype,count=arr.size)
+    shared = shared.reshape(arr.shape)
+    shared[...] = arr
+    shared.flags.writeable = False
+    return shared
+
+########################## CLASSES ###########################
+
+class HerschelMap(object):
+    """
+    A Herschel map held in shared memory
+
+    path:       path to the map
+    data:       read-only image data in MJy/sr
+    header:     image header
+    wcs:        astropy WCS solution built from header
+    band:       SPIRE band, one of the keys of SPIRE
+    beam:       resolution of the band in arcseconds
+    """
+    def __init__(self,path):
+        self.path = path
+        hdulist = fits.open(path,memmap=False)
+        try:
+            # Raw SPIRE products keep the map in the IMAGE extension
+            if 'IMAGE' in [hdu.name for hdu in hdulist]:
+                hdu = hdulist['IMAGE']
+            else:
+                hdu = [h for h in hdulist if h.header.get('NAXIS',0) > 0][0]
+            data = np.asarray(hdu.data,dtype=np.float64)
+            self.header = hdu.header.copy()
+        finally:
+            hdulist.close()
+        self.band = self._band()
+        self.beam = SPIRE[self.band]
+        if self.header.get('UNITS','').strip() != 'MJy/sr':
+            data = data*K_PtoE[self.band]
+            self.header['UNITS'] = 'MJy/sr'
+        self.wcs = wcs.WCS(self.header)
+        self.data = sharedarray(data)
+
+    def _band(self):
+        """
+        Finds the SPIRE band from the file name or the WAVELENGTH keyword
+        """
+        for key in spirekeys:
+            if key in os.path.basename(self.path):
+                return key
+        return codewavelength[int(self.header['WAVELENGTH'])]
+
+    @property
+    def image(self):
+        """
+        The map as a (data, header, WCS) tuple, as accepted by regrid
+        """
+        return self.data,self.header,self.wcs
+
+class HerschelRegistry(object):
+    """
+    Loads each Herschel map once and hands out the loaded copy
+    """
+    def __init__(self):
+        self.maps = {}
+
+    def load(self,paths):
+        """
+        Loads every map in paths that is not already loaded. Call this
+            before starting worker processes, so that they share the maps.
+
+        paths:      list of paths to Herschel maps
+
+        Returns nothing explicitly
+        """
+        for path in paths:
+            self.get(path)
+
+    def get(self,path):
+        """
+        Returns the HerschelMap for path, loading it if needed
+        """
+        if path not in self.maps:
+            self.maps[path] = HerschelMap(path)
+        return self.maps[path]
+
+    def clear(self):
+        """
+        Forgets every map, e.g. when moving on to another cloud
+        """
+        self.maps = {}
@@ -3,6 +3,7 @@ maskdata - contains a function to mask image data
 
 Requires the following modules: os, numpy, docopt, astropy
                                 matplotlib
+Requires the following files:   frameio.py
 
 Contains the following functions: maskdata
 """
@@ -12,11 +13,13 @@ Contains the following functions: maskdata
 import os
 from numpy import *
 from astropy.io import fits
+from frameio import writeimage
 import matplotlib.pyplot as plt
 
 ########################### FUNCTIONS ############################
 
-def maskdata(data,starmap,cutoff,masksave = 0,outfile=0,header=0):
+def maskdata(data,starmap,cutoff,masksave = 0,outfile=0,header=0,
+             writer=writeimage):
     """
     Masks data according to starmap
 
@@ -32,6 +35,9 @@ def maskdata(data,starmap,cutoff,masksave = 0,outfile=0,header=0):
     header:         header information, if masked image is to
                     be saved - if value is zero, do not save file
                     (kwarg, default = 0)
+    writer:         function called as writer(fname,data,header) to save
+                    the mask and masked image, e.g. to hand them to an
+                    ArtifactStore (kwarg, default = writeimage)
 
     Returns masked data.
     """
@@ -44,13 +50,13 @@ def maskdata(data,starmap,cutoff,masksave = 0,outfile=0,header=0):
     mask[below] = 1
     # Save mask, if required
     if masksave != 0 and header != 0:
-        fits.writeto(masksave,mask,header,clobber=True)
+        writer(masksave,mask,header)
     # Mask the image
     maskeddata = mask*data
     # Save the file, if necessary
     if outfile != 0 and header != 0:
         header['MASKCUT'] = cutoff
-        fits.writeto(outfile,maskeddata,header,clobber=True)
+        writer(outfile,maskeddata,header)
         return maskeddata,header
     elif outfile == 0 or header == 0:
         return maskeddata,0
@@ -0,0 +1,418 @@
+"""
+pipeline - contains classes to declare processing stages with explicit
+    inputs and outputs and to run them in dependency order
+
+A stage depends on another if it requires it by name or if one of its
+inputs is one of the other stage's outputs. A stage is stale, and is run,
+if it is forced, if any of its outputs is missing, if any of its input files
+is newer than its oldest output, or if a stage it depends on ran and rewrote
+one of its inputs. The modification times catch inputs that were remade by
+an earlier or interrupted run, or by hand. A stage may update one of its
+inputs in place, e.g. to add header keywords, and the stages it depends on
+then ignore that file's modification time, so that the pipeline still
+settles with nothing to do. Otherwise its result is loaded from its outputs,
+if it has a load function, so that stages that only require another by name
+can use its result without making it run. Stages whose dependencies are all
+finished run at the same time, up to the number of threads given to the
+scheduler.
+
+If the scheduler is given an ArtifactCache, stages that declare their
+parameters are instead keyed by a hash of their input files and parameters.
+Such a stage is up to date exactly when its outputs were made with the same
+key, whether or not it is forced, and a stale one is restored from the
+cache when an earlier run with that key was kept.
+
+Every stage that runs is timed as a span, named by its 'stage' tag.
+
+If the scheduler is given an ArtifactStore, stages may put their outputs in
+it to be written in the background. Files still being written are saved
+before a stage that does not read its inputs through the store starts, or
+before a keyed stage hashes its inputs, and images in memory are dropped
+when a stage rewrites their files directly. Once a stage that reads its
+inputs from memory finishes, its inputs are saved and any of its outputs
+that ended up older than them are touched. testpipeline.py checks that a
+keyed stage sees an input that is still being written.
+
+Requires the following modules: os, threading, collections, multiprocessing
+Requires the following files:   timing.py
+
+Contains the following functions: mtime
+
+Contains the following classes: StageSkip, Stage, Scheduler
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from timing import span
+
+########################## FUNCTIONS ###########################
+
+def mtime(fname):
+    """
+    Returns the modification time of fname, or None if it does not exist
+    """
+    if os.path.isfile(fname):
+        return os.path.getmtime(fname)
+    return None
+
+########################## CLASSES ###########################
+
+class StageSkip(Exception):
+    """
+    Raised by a stage that cannot produce its outputs, e.g. when photometry
+        fails. Stages that depend on it are skipped.
+    """
+    pass
+
+class Stage(object):
+    """
+    A node of the pipeline
+
+    name:           unique name of the stage
+    run:            function called with the results dictionary when the
+                    stage is stale - its return value becomes the stage
+                    result
+    inputs:         list of files the stage reads (kwarg, default = [])
+    outputs:        list of files the stage writes (kwarg, default = [])
+    requires:       list of names of stages that must finish first
+                    (kwarg, default = [])
+    load:           function called with the results dictionary when the
+                    stage is up to date, returning the stage result - if
+                    None, the result is None (kwarg, default = None)
+    force:          if True, run the stage even if its outputs exist
+                    (kwarg, default = False)
+    lock:           name of a lock to hold while running, for stages that
+                    share scratch files or are not thread safe - if None,
+                    hold no lock (kwarg, default = None)
+    params:         function called with the results dictionary, returning
+                    a dictionary of the parameters that affect the outputs,
+                    used to key the stage in the scheduler's cache - if None,
+                    the stage is not cached (kwarg, default = None)
+    tags:           dictionary saved with the stage's timing span, e.g.
+                    frame and band - its 'stage' entry names the span, and
+                    if missing the stage name is used (kwarg, default = {})
+    inmemory:       if True, the stage reads its inputs through the
+                    scheduler's store, so they need not be on disk before
+                    it starts - a stage with params still waits for them,
+                    as its cache key hashes the files (kwarg, default = False)
+    updates:        list of inputs the stage rewrites in place, e.g. to add
+                    header keywords - stages after it see them as changed
+                    when it runs, and the stages it depends on do not
+                    compare their modification times (kwarg, default = [])
+    """
+    def __init__(self,name,run,inputs=[],outputs=[],requires=[],load=None,
+                 force=False,lock=None,params=None,tags={},inmemory=False,
+                 updates=[]):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.requires = list(requires)
+        self.load = load
+        self.force = force
+        self.lock = lock
+        self.params = params
+        self.tags = dict(tags)
+        self.inmemory = inmemory
+        self.updates = list(updates)
+
+    def missing(self):
+        """
+        Returns the list of outputs that do not exist
+        """
+        return [f for f in self.outputs if not os.path.isfile(f)]
+
+    def outdated(self,untimed=[]):
+        """
+        Returns True if any input file is newer than the oldest output.
+            Inputs that are not files, e.g. directories, are not compared.
+
+        untimed:    list of inputs not to compare, e.g. because a later
+                    stage rewrites them (kwarg, default = [])
+        """
+        outtimes = [mtime(f) for f in self.outputs]
+        if outtimes == [] or None in outtimes:
+            return False
+        intimes = [t for t in [mtime(f) for f in self.inputs
+                               if f not in untimed] if t != None]
+        return intimes != [] and max(intimes) > min(outtimes)
+
+class Scheduler(object):
+    """
+    Runs a set of stages in dependency order, rerunning only stale stages
+
+    threads:        maximum number of stages to run at once
+                    (kwarg, default = 1)
+    verbose:        if True, print each decision (kwarg, default = False)
+    cache:          ArtifactCache used for stages with params - if None,
+                    every stage is checked by its outputs alone
+                    (kwarg, default = None)
+    store:          ArtifactStore through which stages pass images - if
+                    None, stages read and write files directly
+                    (kwarg, default = None)
+    """
+    def __init__(self,threads=1,verbose=False,cache=None,store=None):
+        self.threads = threads
+        self.verbose = verbose
+        self.cache = cache
+        self.store = store
+        self.stages = OrderedDict()
+        self.locks = {}
+        self.results = {}
+        # Stage name -> 'ran', 'loaded', 'skipped' or 'failed'
+        self.status = {}
+        # Stage name -> outputs written when the stage ran
+        self.changed = {}
+
+    def add(self,name,run,**kwd):
+        """
+        Declares a stage - see Stage for the arguments
+
+        Returns the Stage
+        """
+        if name in self.stages:
+            raise KeyError('Duplicate stage '+name)
+        stage = Stage(name,run,**kwd)
+        self.stages[name] = stage
+        if stage.lock != None and stage.lock not in self.locks:
+            self.locks[stage.lock] = threading.Lock()
+        return stage
+
+    def dependencies(self,stage):
+        """
+        Finds the stages that must finish before stage can start
+
+        stage:      Stage
+
+        Returns a list of stage names
+        """
+        deps = [name for name in stage.requires if name in self.stages]
+        for other in self.stages.values():
+            if other is stage or other.name in deps:
+                continue
+            if set(other.outputs) & set(stage.inputs):
+                deps.append(other.name)
+        return deps
+
+    def order(self):
+        """
+        Sorts the stages so that each comes after its dependencies
+
+        Returns a list of stage names
+        """
+        deps = dict([(name,self.dependencies(stage))
+                     for name,stage in self.stages.items()])
+        ordered = []
+        done = set()
+        while len(ordered) < len(self.stages):
+            ready = [name for name in self.stages if name not in done and
+                     all([d in done for d in deps[name]])]
+            if ready == []:
+                raise ValueError('Stages have a circular dependency')
+            ordered += ready
+            done.update(ready)
+        return ordered
+
+    def untimed(self,stage):
+        """
+        Finds the inputs of stage that a stage depending on it updates in
+            place, so that their modification times are newer than stage's
+            outputs without making them out of date
+
+        stage:      Stage
+
+        Returns a list of file names
+        """
+        return [f for other in self.stages.values() if other is not stage and
+                stage.name in self.dependencies(other)
+                for f in other.updates if f in stage.inputs]
+
+    def stale(self,stage):
+        """
+        Decides whether stage must run, given the status of its dependencies
+
+        stage:      Stage
+
+        Returns True if the stage must run
+        """
+        if (stage.force or stage.missing() != [] or
+            stage.outdated(self.untimed(stage))):
+            return True
+        inputs = set(stage.inputs)
+        return any([self.changed.get(d,set()) & inputs
+                    for d in self.dependencies(stage)])
+
+    def plan(self):
+        """
+        Lists the stages that would run if nothing failed, without running
+            anything. The parameters of cached stages depend on the results
+            of earlier stages, so a cached stage is expected to be up to
+            date if its outputs were recorded by any earlier run.
+
+        Returns a list of stage names in run order
+        """
+        torun = []
+        for name in self.order():
+            stage = self.stages[name]
+            inputs = set(stage.inputs)
+            if stage.params != None and self.cache != None:
+                stale = self.cache.current(stage.outputs) == None
+            else:
+                stale = stage.force or stage.outdated(self.untimed(stage))
+            if (stale or stage.missing() != [] or
+                any([d in torun and
+                     set(self.stages[d].outputs+self.stages[d].updates) &
+                     inputs
+                     for d in self.dependencies(stage)])):
+                torun.append(name)
+        return torun
+
+    def _execute(self,name):
+        """
+        Runs or loads a single stage, recording its result and status
+        """
+        stage = self.stages[name]
+        deps = self.dependencies(stage)
+        if any([self.status.get(d) in ['skipped','failed'] for d in deps]):
+            self.status[name] = 'skipped'
+            return
+        try:
+            key = None
+            if stage.params != None and self.cache != None:
+                if self.store != None:
+                    # The key hashes the input files, so they must hold
+                    # what upstream stages put in the store
+                    self.store.flush(stage.inputs)
+                key = self.cache.key(stage.inputs,stage.params(self.results))
+                stale = (stage.missing() != [] or
+                         self.cache.current(stage.outputs) != key)
+            else:
+                stale = self.stale(stage)
+            if not stale:
+                if self.verbose:
+                    print 'Up to date: '+name
+                result = None
+                if stage.load != None:
+                    result = stage.load(self.results)
+                self.results[name] = result
+                self.status[name] = 'loaded'
+                return
+            if self.store != None:
+                # Finish writing this stage's outputs before they are
+                # checked or replaced on disk
+                self.store.flush(stage.outputs)
+            if key != None and self.cache.restore(key,stage.outputs):
+                if self.store != None:
+                    self.store.forget(stage.outputs)
+                if self.verbose:
+                    print 'Restored from cache: '+name
+                result = None
+                if stage.load != None:
+                    result = stage.load(self.results)
+                self.results[name] = result
+                self.changed[name] = set(stage.outputs)
+                self.status[name] = 'ran'
+                return
+            if self.verbose:
+                print 'Running: '+name
+            if self.store != None and not stage.inmemory:
+                self.store.flush(stage.inputs)
+            written = stage.outputs+stage.updates
+            before = dict([(f,self._version(f)) for f in written])
+            tags = dict(stage.tags)
+            spanname = tags.pop('stage',name)
+            if stage.lock != None:
+                with self.locks[stage.lock]:
+                    with span(spanname,**tags):
+                        result = stage.run(self.results)
+            else:
+                with span(spanname,**tags):
+                    result = stage.run(self.results)
+            changed = set([f for f in written
+                           if self._version(f) != before[f]])
+            if self.store != None:
+                # Files rewritten other than through the store are stale
+                # in memory
+                self.store.forget([f for f in changed
+                                   if self.store.version(f) ==
+                                   before[f][1]])
+                if stage.inmemory:
+                    self._settle(stage)
+            if key != None:
+                if self.store != None:
+                    self.store.flush(stage.outputs)
+                self.cache.store(key,name,stage.outputs)
+            self.results[name] = result
+            self.changed[name] = changed
+            self.status[name] = 'ran'
+        except StageSkip as e:
+            print 'Skipping '+name+' and the stages after it: '+str(e)
+            self.status[name] = 'failed'
+
+    def _settle(self,stage):
+        """
+        Waits for the inputs and outputs of a stage that read its inputs
+            from memory to be written, then marks any output older than an
+            input as modified now. Outputs saved while an input was still
+            being written are up to date, but would otherwise look older.
+        """
+        self.store.flush(stage.inputs+stage.outputs)
+        intimes = [t for t in [mtime(f) for f in stage.inputs] if t != None]
+        if intimes == []:
+            return
+        for fname in stage.outputs:
+            outtime = mtime(fname)
+            if outtime != None and outtime < max(intimes):
+                os.utime(fname,None)
+
+    def _version(self,fname):
+        """
+        Returns the modification time of fname and the number of times it
+            was put in the store, which change when a stage rewrites it
+        """
+        if self.store != None:
+            return (mtime(fname),self.store.version(fname))
+        return (mtime(fname),0)
+
+    def run(self):
+        """
+        Runs every stale stage and loads every up to date one. Stages whose
+            dependencies have finished are started together, up to the
+            number of threads.
+
+        Returns the dictionary of stage results
+        """
+        order = self.order()
+        deps = dict([(name,self.dependencies(self.stages[name]))
+                     for name in order])
+        if self.threads <= 1:
+            for name in order:
+                self._execute(name)
+            return self.results
+        pool = ThreadPool(self.threads)
+        try:
+            pending = {}
+            while len(self.status) < len(order):
+                for name in order:
+                    if (name not in self.status and name not in pending and
+                        all([d in self.status for d in deps[name]])):
+                        pending[name] = pool.apply_async(self._execute,
+                                                         (name,))
+                # Wait for the first running stage to finish
+                finished = None
+                while finished == None:
+                    for name,result in pending.items():
+                        if result.ready():
+                            finished = name
+                            break
+                    else:
+                        pending.values()[0].wait(0.1)
+                pending.pop(finished).get()
+        finally:
+            pool.terminate()
+        return self.results
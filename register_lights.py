@@ -23,6 +23,7 @@ import glob
 import shutil
 import subprocess
 import re
+from toolrunner import runtool, start, waitall
 
 sextractor_config = """
     ANALYSIS_THRESH 1.5
@@ -198,9 +199,12 @@ if __name__ == "__main__":
     catalogs = [re.sub('.fits$', '.cat', image) for image in images]
     headers = [re.sub('.fits$', '.head', image) for image in images]
 
+    # Run SExtractor on every image at once, as far as its slots allow
+    runs = []
     for image, catalog in zip(images, catalogs):
         print sexloc+" -c {config} -CATALOG_NAME {catalog} {image}".format(config=sextractor_config_name, catalog=catalog, image=image)
-        subprocess.call(sexloc+" -c {config} -CATALOG_NAME {catalog} -CATALOG_TYPE FITS_LDAC {image}".format(config=sextractor_config_name, catalog=catalog, image=image), shell=True)
+        runs.append(start(sexloc+" -c {config} -CATALOG_NAME {catalog} -CATALOG_TYPE FITS_LDAC {image}".format(config=sextractor_config_name, catalog=catalog, image=image), frame=os.path.basename(image)))
+    waitall(runs)
 
     if verbose:
         print ""
@@ -227,7 +231,7 @@ if __name__ == "__main__":
     swarp_command = swarp_command + " -IMAGEOUT_NAME {0} {1}"
     for image, catalog in zip(images, catalogs):
         # scamp
-        subprocess.call(scamp_command.format(scamp_config_name,catalog),shell=True)
+        runtool(scamp_command.format(scamp_config_name,catalog),frame=os.path.basename(image))
         # Move scamp outputs
         for scampfile in glob.glob('*.png'):
             moveit(scampfile,output_directory+'/scampout/')
@@ -235,7 +239,7 @@ if __name__ == "__main__":
         registered_image = os.path.basename(image)
         registered_image = re.sub('.fits$', '_reg.fits', registered_image)
         registered_image = os.path.join(output_directory, registered_image)
-        subprocess.call(swarp_command.format(registered_image, image), shell=True)
+        runtool(swarp_command.format(registered_image, image),frame=os.path.basename(image))
 
     # Create a stack
     '''
@@ -1,162 +1,347 @@
 """
 regrid - contains functions to do regriding and reshaping of image data
 
-Requires the following modules: astropy, numpy, docopt, scipy, time,
-                                collections
-Requires the following files:   cartesian.py
+Requires the following modules: os, astropy, numpy, docopt, scipy, time,
+                                hashlib, threading, collections
+Requires the following files:   cartesian.py, workspace.py
 
-Contains the following functions: regrid_lowmemory, regrid, nanlimits,
-                                  valfilter, reshapeparams, reshape
+Contains the following functions: loadimage, plankey, approxmap, makeplan,
+                                  overlap, regrid, nanlimits, valfilter,
+                                  reshapeparams, reshape
+
+Contains the following classes: ReprojectionPlan, PlanCache
 """
 
+import os
 from astropy.io import fits
 from astropy import wcs
 from numpy import *
 import docopt
 import scipy.interpolate
 import time
+import hashlib
+import threading
 from cartesian import cartesian
+from workspace import partname
 from collections import Counter, OrderedDict
 
-def regrid_lowmemory(sourceimage,targetimage,fillval = NAN,theader = 0):
+# Approximate bytes used per target pixel by the coordinate arrays of a tile
+bytesperpixel = 96
+# Names of the arrays of each tile of a ReprojectionPlan, as saved
+tilearrays = ['ypixs','xpixs','ydpixs','xdpixs']
+
+def loadimage(image):
     """
-    A low memory version of regrid, this takes sourceimage and puts it onto
-        targetimage grid, using wcs solutions for both. Grid points with 
-        no info from sourceimage are set to fillval.
+    Gets the data, header and WCS solution of an image given either as a
+        file or as data already in memory
 
-    sourceimage:    path to image to regrid - should already be convolved 
-                    to appropriate resolution using resconvolve
-    targetimage:    path to image whose grid is to be used in regridding
-    fillval:        value to give to empty grid positions
-                    (kwarg, default = NAN)
-    theader:        specify a header containing WCS solution to use
-                    (kwarg, default = 0)
+    image:      path to image, or tuple of image data and header, optionally
+                followed by a WCS object already built from the header
 
-    Returns array with targetimage dimensions.       
+    Returns image data, header and WCS object
+    """
+    if isinstance(image,str):
+        data,header = fits.getdata(image,header = True)
+        return data,header,wcs.WCS(header)
+    if len(image) == 3:
+        data,header,imagewcs = image
+        return asarray(data),header,imagewcs
+    data,header = image
+    return asarray(data),header,wcs.WCS(header)
 
+def plankey(sourcewcs,sshape,targetwcs,region,tolerance = None,step = 32):
     """
-    # Start timer
-    start = time.time()
-    # Load in source data and header information
-    sdata,sheader = fits.getdata(sourceimage,header = True)
-    # Create WCS object for the source image
-    sourcewcs = wcs.WCS(sheader)
+    Identifies the mapping between two grids
+
+    sourcewcs:  WCS object of the source image
+    sshape:     shape of the source image
+    targetwcs:  WCS object of the target grid
+    region:     part of the target grid to map, as (first column, end
+                column, first row, end row)
+    tolerance:  largest allowed error in source pixels of an approximate
+                mapping - if None, the mapping is exact
+                (kwarg, default = None)
+    step:       spacing in target pixels of the control grid of an
+                approximate mapping (kwarg, default = 32)
+
+    Returns a hex string
+    """
+    sha = hashlib.sha1()
+    for w in [sourcewcs,targetwcs]:
+        sha.update(w.to_header(relax=True).tostring())
+    sha.update(repr((tuple(sshape),tuple(region))))
+    if tolerance != None:
+        sha.update(repr((tolerance,step)))
+    return sha.hexdigest()
+
+def approxmap(sourcewcs,targetwcs,region,tolerance,step = 32):
+    """
+    Approximates the mapping from target pixels to source pixels by bicubic
+        splines through the exact mapping on a sparse control grid
+
+    The error of the splines is measured with the exact mapping at the
+    centres of the control grid cells, where it is largest.
+
+    sourcewcs:  WCS object of the source image
+    targetwcs:  WCS object of the target grid
+    region:     part of the target grid to map, as (first column, end
+                column, first row, end row)
+    tolerance:  largest allowed error in source pixels
+    step:       spacing of the control grid in target pixels
+                (kwarg, default = 32)
+
+    Returns splines giving source x and source y at target (x, y) and the
+    largest error found - the splines are None if the error exceeds
+    tolerance, and the error is also None if the region is too small or
+    partly outside the valid range of either WCS solution
+    """
+    dx,ux,dy,uy = region
+    # Control points every step pixels, always including the last ones
+    cx = unique(append(arange(dx,ux,step),ux-1))
+    cy = unique(append(arange(dy,uy,step),uy-1))
+    # Cubic splines need more than three points on each axis
+    if len(cx) < 4 or len(cy) < 4:
+        return None,None,None
+    def exact(xs,ys):
+        coords = cartesian([xs,ys])
+        dpix = sourcewcs.wcs_world2pix(targetwcs.wcs_pix2world(coords,0),0)
+        return (dpix[:,0].reshape(len(xs),len(ys)),
+                dpix[:,1].reshape(len(xs),len(ys)))
+    xd,yd = exact(cx,cy)
+    if not (isfinite(xd).all() and isfinite(yd).all()):
+        return None,None,None
+    xspline = scipy.interpolate.RectBivariateSpline(cx,cy,xd)
+    yspline = scipy.interpolate.RectBivariateSpline(cx,cy,yd)
+    # Compare with the exact mapping halfway between control points
+    mx = (cx[:-1]+cx[1:])/2.
+    my = (cy[:-1]+cy[1:])/2.
+    xm,ym = exact(mx,my)
+    if not (isfinite(xm).all() and isfinite(ym).all()):
+        return None,None,None
+    residual = hypot(xspline(mx,my)-xm,yspline(mx,my)-ym).max()
+    if not residual <= tolerance:
+        return None,None,residual
+    return xspline,yspline,residual
+
+def makeplan(sourcewcs,sshape,targetwcs,region,max_bytes = 2**28,
+             tolerance = None,step = 32):
+    """
+    Maps the pixels of part of a target grid onto a source image
+
+    The target grid is processed in tiles of whole rows, each transformed
+    at once, with as many rows per tile as fit in max_bytes. Every pixel is
+    computed independently, so the result does not depend on the tile size.
+
+    Given a tolerance, the mapping is approximated as in approxmap, which
+    is much faster for large grids, unless the approximation is worse than
+    tolerance, in which case the exact mapping is used. The error of the
+    approximation is printed and kept with the plan. The plan keeps the
+    valid pixels of each tile separately, so no step needs memory for the
+    whole region at once.
+
+    sourcewcs:  WCS object of the source image
+    sshape:     shape of the source image
+    targetwcs:  WCS object of the target grid
+    region:     part of the target grid to map, as (first column, end
+                column, first row, end row)
+    max_bytes:  approximate memory to use for the coordinates of one tile
+                (kwarg, default = 2**28)
+    tolerance:  largest allowed error in source pixels of an approximate
+                mapping - if None, use the exact mapping
+                (kwarg, default = None)
+    step:       spacing in target pixels of the control grid of an
+                approximate mapping (kwarg, default = 32)
+
+    Returns a ReprojectionPlan
+    """
+    dx,ux,dy,uy = region
+    xspline,yspline,residual = None,None,None
+    if tolerance != None:
+        xspline,yspline,residual = approxmap(sourcewcs,targetwcs,region,
+                                             tolerance,step = step)
+        if xspline != None:
+            print 'Approximate mapping error',residual,'pix'
+        elif residual != None:
+            print 'Approximate mapping error',residual,'pix exceeds',
+            print tolerance,'pix, using exact mapping'
+            residual = None
     # Create array of pixel indices in source image
-    x = arange(sdata.shape[1])
-    y = arange(sdata.shape[0])
-    # Interpolate the image data over pixel indices
-    interp = scipy.interpolate.RectBivariateSpline(y,x,sdata)
-    # Load in target grid data
-    if theader == 0:
-        tdata,theader = fits.getdata(targetimage,header=True)
-    if theader != 0:
-        tdata = fits.getdata(targetimage)
-    # Create WCS object for target grid
-    targetwcs = wcs.WCS(theader)
-    # Create all possible pairs of pixel coordinates in target grid
-    coords = cartesian([arange(tdata.shape[1]),arange(tdata.shape[0])])
-    # Extract x and y columns of pixel pairs
-    xpixs = coords[:,0]
-    ypixs= coords[:,1]
-    # Convert target grid pixels to ra/dec 
-    world = targetwcs.wcs_pix2world(coords,0)
-    # Convert target grid ra/dec to source pixel coordinates
-    dpix = sourcewcs.wcs_world2pix(world,0)
-    # Extract x and y columns of converted pixel pairs
-    xdpixs = dpix[:,0]
-    ydpixs = dpix[:,1]
-    # Find where target grid corresponds to actual source image data
-    good = where((xdpixs >= min(x)) & (xdpixs <= max(x)) & (ydpixs >= min(y)) & (ydpixs <= max(y)))
-    # Pick out only pixels with relevant image data
-    xpixs = xpixs[good]
-    ypixs = ypixs[good]
-    xdpixs = xdpixs[good]
-    ydpixs = ydpixs[good]
-    # Create grid to fill up with source image regrid
-    tofill = copy(tdata)
-    tofill[:] = fillval
-    # Loop over relevant pixels and fill up source image regrid
-    for i in range(len(ypixs)):
-        ypix = ypixs[i]
-        xpix = xpixs[i]
-        xdpix = xdpixs[i]
-        ydpix = ydpixs[i]
-        tofill[ypix,xpix] = interp(ydpix,xdpix)
-    # End timer
-    end = time.time()
-    # Print time to run
-    print 'Regridded in ',(end-start)/60.,' min'
-    return tofill,tdata
+    x = arange(sshape[1])
+    y = arange(sshape[0])
+    # Choose rows per tile to fit the coordinate arrays in max_bytes
+    rows = int(max_bytes//(bytesperpixel*(ux-dx if ux > dx else 1)))
+    if rows < 1:
+        rows = 1
+    tiles = []
+    for ty in range(dy,uy,rows):
+        # Create all possible pairs of pixel coordinates in this tile
+        coords = cartesian([arange(dx,ux),arange(ty,min(ty+rows,uy))])
+        # Extract x and y columns of pixel pairs
+        xpixs = coords[:,0]
+        ypixs = coords[:,1]
+        if xspline != None:
+            # Evaluate the approximate mapping
+            xdpixs = xspline(xpixs,ypixs,grid=False)
+            ydpixs = yspline(xpixs,ypixs,grid=False)
+        else:
+            # Convert target grid pixels to ra/dec 
+            world = targetwcs.wcs_pix2world(coords,0)
+            # Convert target grid ra/dec to source pixel coordinates
+            dpix = sourcewcs.wcs_world2pix(world,0)
+            # Extract x and y columns of converted pixel pairs
+            xdpixs = dpix[:,0]
+            ydpixs = dpix[:,1]
+        # Find where target grid corresponds to actual source image data
+        good = where((xdpixs >= min(x)) & (xdpixs <= max(x)) & 
+                     (ydpixs >= min(y)) & (ydpixs <= max(y)))
+        tiles.append(((ypixs[good]-dy).astype(int32),
+                      (xpixs[good]-dx).astype(int32),
+                      ydpixs[good],xdpixs[good]))
+    key = plankey(sourcewcs,sshape,targetwcs,region,tolerance = tolerance,
+                  step = step)
+    return ReprojectionPlan(key,(uy-dy,ux-dx),tiles,residual = residual)
 
+def overlap(sourcewcs,sshape,targetwcs,tshape,pad = 2,samples = 64):
+    """
+    Finds the part of a target grid that a source image covers, from the
+        bounding box of points along the source image's edges projected
+        onto the target grid
+
+    sourcewcs:  WCS object of the source image
+    sshape:     shape of the source image
+    targetwcs:  WCS object of the target grid
+    tshape:     shape of the target grid
+    pad:        target pixels to add on each side of the bounding box, to
+                allow for edges curving between the points
+                (kwarg, default = 2)
+    samples:    number of points along each edge (kwarg, default = 64)
+
+    Returns the region as (first column, end column, first row, end row),
+    which is the whole target grid if any point cannot be projected
+    """
+    ny,nx = sshape
+    whole = (0,tshape[1],0,tshape[0])
+    if nx == 0 or ny == 0:
+        return whole
+    # Points along the edges of the source image, corners included
+    xs = unique(linspace(0,nx-1,samples if nx > samples else nx))
+    ys = unique(linspace(0,ny-1,samples if ny > samples else ny))
+    edges = concatenate([column_stack([xs,zeros(len(xs))]),
+                         column_stack([xs,ones(len(xs))*(ny-1)]),
+                         column_stack([zeros(len(ys)),ys]),
+                         column_stack([ones(len(ys))*(nx-1),ys])])
+    # Project them onto the target grid
+    tpixs = targetwcs.wcs_world2pix(sourcewcs.wcs_pix2world(edges,0),0)
+    if not isfinite(tpixs).all():
+        return whole
+    dx = int(clip(floor(tpixs[:,0].min())-pad,0,tshape[1]))
+    ux = int(clip(ceil(tpixs[:,0].max())+1+pad,dx,tshape[1]))
+    dy = int(clip(floor(tpixs[:,1].min())-pad,0,tshape[0]))
+    uy = int(clip(ceil(tpixs[:,1].max())+1+pad,dy,tshape[0]))
+    return dx,ux,dy,uy
 
-def regrid(sourceimage,targetimage,fillval = NAN,theader = 0,tpix = []):
+def regrid(sourceimage,targetimage,fillval = NAN,theader = 0,tpix = [],
+           max_bytes = 2**28,plandir = None,tolerance = None,step = 32,
+           cutout = False):
     """
     This takes sourceimage and puts it onto targetimage grid, using wcs 
         solutions for both. Grid points with no info from sourceimage are 
         set to fillval. Requires scipy0.14.0
 
-    sourceimage:    path to image to regrid - should already be convolved 
-                    to appropriate resolution using resconvolve
-    targetimage:    path to image whose grid is to be used in regridding
+    Only the part of the target grid that the source image covers, found
+    by overlap, is transformed and interpolated, unless tpix gives the part
+    to fill. The mapping between the grids is kept as a ReprojectionPlan,
+    so later calls between the same grids only interpolate. Arrays on the
+    same grid, e.g. an image and its object map, can be regridded together
+    as a stack, sharing one plan lookup and one fill of the output.
+
+    sourceimage:    path to image to regrid, or tuple of its data and
+                    header - should already be convolved to appropriate
+                    resolution using resconvolve. The data may be a stack
+                    of arrays on the grid the header describes, indexed
+                    along the first axis.
+    targetimage:    path to image whose grid is to be used in regridding,
+                    or tuple of its data and header
     fillval:        value to give to empty grid positions
                     (kwarg, default = NAN)
     theader:        specify a header containing WCS solution to use
                     (kwarg, default = 0)
+    tpix:           with theader, the part of the target grid to fill, as
+                    [first column, end column, first row, end row]
+                    (kwarg, default = [])
+    max_bytes:      approximate memory to use for the coordinates of one
+                    tile when making a plan, and for the points
+                    interpolated at once (kwarg, default = 2**28)
+    plandir:        directory in which to keep plans between runs - if
+                    None, keep them in memory only (kwarg, default = None)
+    tolerance:      largest allowed error in source pixels of an
+                    approximate mapping between the grids, as in makeplan
+                    - if None, use the exact mapping (kwarg, default = None)
+    step:           spacing in target pixels of the control grid of an
+                    approximate mapping (kwarg, default = 32)
+    cutout:         if True, return only the filled part of the target grid
+                    and its offsets (kwarg, default = False)
 
-    Returns array with targetimage dimensions.      
+    Returns array with targetimage dimensions, or for a stack, a stack of
+    such arrays, and the target data. If cutout is True, both are cut to
+    the filled part, and the (row, column) in the target grid of their
+    first pixel is also returned.
     """
     # Start timer
     start = time.time()
     # Load in source data and header information
-    sdata,sheader = fits.getdata(sourceimage,header = True)
-    # Create WCS object for the source image
-    sourcewcs = wcs.WCS(sheader)
+    sdata,sheader,sourcewcs = loadimage(sourceimage)
+    stack = sdata.ndim == 3
+    if not stack:
+        sdata = sdata[newaxis]
     # Create array of pixel indices in source image
-    x = arange(sdata.shape[1])
-    y = arange(sdata.shape[0])
-    # Interpolate the image data over pixel indices
-    interp = scipy.interpolate.RectBivariateSpline(y,x,sdata)
+    x = arange(sdata.shape[2])
+    y = arange(sdata.shape[1])
     # Load in target grid data
+    targetwcs = None
     if theader == 0 or tpix == []:
-        tdata,theader = fits.getdata(targetimage,header=True)
-        # Create all possible pairs of pixel coordinates in target grid
-        coords = cartesian([arange(tdata.shape[1]),arange(tdata.shape[0])])
+        tdata,theader,targetwcs = loadimage(targetimage)
+        # (row, column) in the target grid of the first pixel of tdata
+        origin = (0,0)
+        region = None
     elif theader != 0 and tpix != []:
         assert len(tpix) == 4
-        dx,ux,dy,uy = tpix
-        # Create all possible pairs of pixel coordinates in target grid
-        tdata = zeros((uy-dy,ux-dx))
-        coords = cartesian([arange(dx,ux),arange(dy,uy)])
-    # Extract x and y columns of pixel pairs
-    xpixs = coords[:,0]
-    ypixs= coords[:,1]
+        region = tuple(tpix)
+        tdata = zeros((region[3]-region[2],region[1]-region[0]))
+        origin = (region[2],region[0])
     # Create WCS object for target grid
-    targetwcs = wcs.WCS(theader)
-    # Convert target grid pixels to ra/dec 
-    world = targetwcs.wcs_pix2world(coords,0)
-    # Convert target grid ra/dec to source pixel coordinates
-    dpix = sourcewcs.wcs_world2pix(world,0)
-    # Extract x and y columns of converted pixel pairs
-    xdpixs = dpix[:,0]
-    ydpixs = dpix[:,1]
-    # Find where target grid corresponds to actual source image data
-    good = where((xdpixs >= min(x)) & (xdpixs <= max(x)) & 
-                 (ydpixs >= min(y)) & (ydpixs <= max(y)))
-    # Pick out only pixels with relevant image data
-    xpixs = xpixs[good]
-    ypixs = ypixs[good]
-    xdpixs = xdpixs[good]
-    ydpixs = ydpixs[good]
-    # Create grid to fill up with source image regrid
-    tofill = copy(tdata)
+    if targetwcs == None:
+        targetwcs = wcs.WCS(theader)
+    # Limit the work to where the source image lands on the target grid
+    if region == None:
+        region = overlap(sourcewcs,sdata.shape[1:],targetwcs,tdata.shape)
+    dx,ux,dy,uy = region
+    # Find the target pixels on the source image and where they land
+    plan = plans.get(sourcewcs,sdata.shape[1:],targetwcs,region,
+                     max_bytes = max_bytes,tolerance = tolerance,step = step,
+                     directory = plandir)
+    # Interpolate each array's data over pixel indices
+    interps = [scipy.interpolate.RectBivariateSpline(y,x,layer)
+               for layer in sdata]
+    if cutout:
+        tdata = tdata[dy-origin[0]:uy-origin[0],dx-origin[1]:ux-origin[1]]
+        origin = (dy,dx)
+    # Create grids to fill up with source image regrid
+    tofill = empty((len(sdata),)+tdata.shape,dtype = tdata.dtype)
     tofill[:] = fillval
-    # Choose indices of array positions to be changed
-    inds = (ypixs,xpixs)
-    tofill[inds] = interp(ydpixs,xdpixs,grid=False) # needs scipy 0.14.0
+    window = tofill[:,dy-origin[0]:uy-origin[0],dx-origin[1]:ux-origin[1]]
+    # Fill in the plan's points a chunk of max_bytes at a time
+    for ypixs,xpixs,ydpixs,xdpixs in plan.chunks(max_bytes):
+        for layer,interp in zip(window,interps):
+            layer[ypixs,xpixs] = interp(ydpixs,xdpixs,grid=False) # needs scipy 0.14.0
+    if not stack:
+        tofill = tofill[0]
     # End timer
     end = time.time()
     # Print time to run
     print 'Regridded in ',(end-start)/60.,' min'
+    if cutout:
+        return tofill,tdata,origin
     return tofill,tdata
 
 def vallimits(arr,limval = NAN):
@@ -263,3 +448,186 @@ def reshape(data,shapebyarr,ress,limval = NAN):
     rowslice = rowslice[rowdo+ress:rowup-ress]
     newdata = rowslice.T
     return newdata
+
+class ReprojectionPlan(object):
+    """
+    The mapping of part of a target grid onto a source image, reusable for
+        every array regridded between the two
+
+    key:        hex string identifying the two grids, from plankey
+    shape:      shape of the regridded array
+    tiles:      list with one tuple for each tile of the target grid, of the
+                rows and columns in the regridded array of the target
+                pixels that fall on the source image, and the fractional
+                source rows and columns of those pixels
+    residual:   largest error in source pixels of an approximate mapping,
+                or None if the mapping is exact (kwarg, default = None)
+    """
+    def __init__(self,key,shape,tiles,residual = None):
+        self.key = key
+        self.shape = tuple(shape)
+        self.tiles = tiles
+        self.residual = residual
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the plan's arrays
+        """
+        return sum([a.nbytes for tile in self.tiles for a in tile])
+
+    def chunks(self,max_bytes = 2**28):
+        """
+        Splits the plan's points into chunks that can be interpolated in
+            about max_bytes, whatever tile size the plan was made with
+
+        Yields (rows, columns, source rows, source columns) tuples of views
+        into the plan's arrays
+        """
+        size = int(max_bytes//bytesperpixel)
+        if size < 1:
+            size = 1
+        for tile in self.tiles:
+            for first in range(0,len(tile[0]),size):
+                yield tuple([a[first:first+size] for a in tile])
+
+    def save(self,fname):
+        """
+        Saves the plan as a .npz file, replacing fname atomically
+        """
+        part = partname(fname)
+        # An exact mapping is saved with a NaN residual
+        residual = NAN if self.residual == None else self.residual
+        arrays = {}
+        for i,tile in enumerate(self.tiles):
+            for name,a in zip(tilearrays,tile):
+                arrays['%s%d' % (name,i)] = a
+        with open(part,'wb') as fobj:
+            savez(fobj,key=self.key,shape=self.shape,ntiles=len(self.tiles),
+                  residual=residual,**arrays)
+        os.rename(part,fname)
+
+    @classmethod
+    def load(cls,fname):
+        """
+        Reads a plan saved by save
+
+        Returns a ReprojectionPlan
+        """
+        saved = load(fname)
+        try:
+            residual = NAN
+            if 'residual' in saved.files:
+                residual = float(saved['residual'])
+            if 'ntiles' in saved.files:
+                tiles = [tuple([saved['%s%d' % (name,i)]
+                                for name in tilearrays])
+                         for i in range(int(saved['ntiles']))]
+            else:
+                # Plans saved in one piece
+                tiles = [tuple([saved[name] for name in tilearrays])]
+            return cls(str(saved['key']),saved['shape'],tiles,
+                       residual = None if isnan(residual) else residual)
+        finally:
+            saved.close()
+
+class PlanCache(object):
+    """
+    Keeps the most recently used ReprojectionPlans in memory, and
+        optionally every plan on disk
+
+    maxplans:   number of plans to keep in memory (kwarg, default = 4)
+    maxbytes:   maximum size of each plan directory in bytes, beyond which
+                the least recently used plans are deleted
+                (kwarg, default = 5*2**30)
+    """
+    def __init__(self,maxplans = 4,maxbytes = 5*2**30):
+        self.maxplans = maxplans
+        self.maxbytes = maxbytes
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.lock = threading.Lock()
+        # Plans of the same key are made once, other plans do not wait
+        self.keylocks = {}
+
+    def get(self,sourcewcs,sshape,targetwcs,region,max_bytes = 2**28,
+            tolerance = None,step = 32,directory = None):
+        """
+        Returns the plan mapping region of the target grid onto the source
+            image, from memory, from directory or newly made - see makeplan
+            for the arguments
+
+        directory:  directory of saved plans, created if missing - if None,
+                    keep plans in memory only (kwarg, default = None)
+        """
+        key = plankey(sourcewcs,sshape,targetwcs,region,tolerance = tolerance,
+                      step = step)
+        with self.lock:
+            keylock = self.keylocks.setdefault(key,threading.Lock())
+        with keylock:
+            with self.lock:
+                if key in self.plans:
+                    self.hits += 1
+                    self.plans[key] = self.plans.pop(key)
+                    return self.plans[key]
+            fname = None
+            if directory:
+                fname = os.path.join(directory,key+'.npz')
+            if fname != None and os.path.isfile(fname):
+                plan = ReprojectionPlan.load(fname)
+                os.utime(fname,None)
+            else:
+                plan = makeplan(sourcewcs,sshape,targetwcs,region,
+                                max_bytes = max_bytes,tolerance = tolerance,
+                                step = step)
+                if fname != None:
+                    if not os.path.isdir(directory):
+                        try:
+                            os.makedirs(directory)
+                        except OSError:
+                            # Another process made it first
+                            pass
+                    plan.save(fname)
+                    self.evict(directory)
+            with self.lock:
+                self.plans[key] = plan
+                while len(self.plans) > self.maxplans:
+                    self.plans.popitem(last=False)
+            return plan
+
+    def evict(self,directory):
+        """
+        Deletes the least recently used plans in directory until it fits in
+            maxbytes
+
+        Returns nothing explicitly
+        """
+        saved = []
+        for f in os.listdir(directory):
+            if not f.endswith('.npz') or f.startswith('.'):
+                continue
+            fname = os.path.join(directory,f)
+            try:
+                saved.append((os.path.getmtime(fname),
+                              os.path.getsize(fname),fname))
+            except OSError:
+                continue
+        saved.sort()
+        total = sum([size for used,size,fname in saved])
+        while total > self.maxbytes and len(saved) > 1:
+            used,size,fname = saved.pop(0)
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Forgets the plans held in memory
+        """
+        with self.lock:
+            self.plans.clear()
+
+# Plans shared by every regrid in this process
+plans = PlanCache()
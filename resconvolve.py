@@ -3,6 +3,7 @@ resconvolve - contains a function to use convolution to change the
     resolution of an image
 
 Requires the following modules: docopt, scipy, numpy, os, astropy
+Requires the following files:   frameio.py
 
 Contains the following functions: resconvolve
 
@@ -15,15 +16,16 @@ import scipy.interpolate
 from numpy import *
 import os
 from astropy.io import fits
+from frameio import writeimage
 
 ########################## FUNCTIONS ###########################
 
 def resconvolve(fname,currentres,desiredres,pixscale = 2.85,
-                outfile=0,header=0):
+                outfile=0,header=0,writer=writeimage):
     """
     Convolves data from currentres to desiredres.
 
-    fname:          image to change resolution of
+    fname:          image file, or image data, to change resolution of
     currentres:     current resolution of the image in arcseconds
     desiredres:     desired resolution to change to in arcseconds
     pixscale:       either float or 2-element list, the pixel scale
@@ -36,11 +38,17 @@ def resconvolve(fname,currentres,desiredres,pixscale = 2.85,
     header:         header information, if convolved image is to
                     be saved - if value is zero, do not save file
                     (kwarg, default = 0)
+    writer:         function called as writer(outfile,data,header) to
+                    save the convolved image, e.g. to hand it to an
+                    ArtifactStore (kwarg, default = writeimage)
 
     Returns convolved data
 
     """
-    data = fits.getdata(fname)
+    if isinstance(fname,str):
+        data = fits.getdata(fname)
+    else:
+        data = asarray(fname)
     # Factor to convert sigma used in scipy.signal.gaussian to FWHM
     s2f = 2*sqrt(2*log(2))
     # Convert resolutions to sigma for scipy.signal.gaussian
@@ -81,7 +89,7 @@ def resconvolve(fname,currentres,desiredres,pixscale = 2.85,
             elif isinstance(pixscale,(list,ndarray)):
                 header['CONVKERX'] = (kernelxsize,'sigma of x-convolution gaussian in dfly pix')
                 header['CONVKERY'] = (kernelysize,'sigma of y-convolution gaussian in dfly pix')
-            fits.writeto(outfile,convolved,header,clobber = True)
+            writer(outfile,convolved,header)
             return convolved,header
         elif header == 0 or outfile == 0:
             return convolved,header
@@ -1,6 +1,9 @@
 import os
 from numpy import *
 import subprocess
+from workspace import publish
+from toolrunner import runtool
+from sexmanager import runsex
 
 
 catalogchecks = {}
@@ -97,10 +100,12 @@ default_nnw = """NNW
  1.00000e+00 
 """   
 
-def scampswarp(image,interptype = 'LANCZOS3',cattype = 'APASS'):
+def scampswarp(image,interptype = 'LANCZOS3',cattype = 'APASS',workspace = '.'):
     """
     image:       name of image to scamped and swarped
     intertype:   interpolation method
+    workspace:   directory for scratch files, private to this call if
+                 images are processed in parallel (kwarg, default = '.')
 
     Updates image and resuffixes it with _ss.fits - saves
     in original image location.
@@ -113,20 +118,28 @@ def scampswarp(image,interptype = 'LANCZOS3',cattype = 'APASS'):
     imageout = name.split('.fits')[0]+'_ss.fits'
     # Choose catalog name
     catalog = image.split('.fits')[0]+'.cat'
+    # Scratch files that would otherwise go in the current directory
+    coadd = os.path.join(workspace,'coadd.fits')
+    checkplots = ','.join([os.path.join(workspace,p) for p in
+                           ['fgroups','distort','astr_interror2d',
+                            'astr_interror1d','astr_referror2d',
+                            'astr_referror1d','astr_chi2','psphot_error']])
     # Check that the chosen catalog overlaps with data
-    os.system('python '+catalogchecks[cattype]+' -v -s /opt/sextractor/2.8.6/bin/sex -r /mnt/scratch-lustre/njones/SURP2015/nscripts/APASS save '+image)
-    # Run sextractor
-    os.system('sex -c default.sex '+image)
-    # rename catalog
-    os.system('mv test.cat '+catalog)
+    runtool('python '+catalogchecks[cattype]+' -v -w '+workspace+' -s /opt/sextractor/2.8.6/bin/sex -r /mnt/scratch-lustre/njones/SURP2015/nscripts/APASS save '+image,frame=name)
+    # Run sextractor, or reuse an earlier run on the same image
+    runsex(image,catalog,config='default.sex',frame=name)
     # Run scamp
-    os.system('scamp -c scamp.default '+catalog)
+    runtool('scamp -c scamp.default -XML_NAME '+os.path.join(workspace,'scamp.xml')+
+           ' -CHECKPLOT_NAME '+checkplots+' '+catalog,frame=name)
     # Run swarp
-    os.system('swarp -c swarp.default '+image)
+    runtool('swarp -c swarp.default -IMAGEOUT_NAME '+coadd+
+           ' -WEIGHTOUT_NAME '+os.path.join(workspace,'coadd.weight.fits')+
+           ' -RESAMPLE_DIR '+workspace+
+           ' -XML_NAME '+os.path.join(workspace,'swarp.xml')+' '+image,frame=name)
     # Rename output image
-    os.system('mv coadd.fits '+imdir+imageout)
+    publish(coadd,imdir+imageout)
     # Check overlap with catalog again
-    os.system('python '+catalogchecks[cattype]+' -v -s /opt/sextractor/2.8.6/bin/sex -r /mnt/scratch-lustre/njones/SURP2015/nscripts/APASS save '+imdir+imageout)
+    runtool('python '+catalogchecks[cattype]+' -v -w '+workspace+' -s /opt/sextractor/2.8.6/bin/sex -r /mnt/scratch-lustre/njones/SURP2015/nscripts/APASS save '+imdir+imageout,frame=name)
 
 
 
@@ -0,0 +1,253 @@
+"""
+sexmanager - contains a class to run SExtractor at most once for each image
+    and configuration, and to share the catalogue and check images between
+    every step that needs them
+
+Runs are keyed by a checksum of the image and of every setting that affects
+the results, including the contents of the parameter, filter and neural
+network files rather than their paths, so steps that write the same
+configuration into different scratch directories share runs. Settings that
+only affect memory use, verbosity or output names are ignored. Each run
+produces the catalogue and all check images requested so far for its key,
+so a later request for another check image of the same image adds it in one
+new run instead of one run per check image. Results are kept in a cache
+directory, whose oldest entries are deleted once it exceeds its size limit,
+and copied to wherever each step asked for them.
+
+Requires the following modules: os, shutil, hashlib, threading
+Requires the following files:   correlate_config.py, toolrunner.py,
+                                workspace.py
+
+Contains the following functions: readconfig, runsex
+
+Contains the following classes: SExtractorManager
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import shutil
+import hashlib
+import threading
+from correlate_config import *
+from toolrunner import runtool
+from workspace import partname
+
+########################## DATA LISTS ###########################
+
+# Settings that do not change the catalogue or check images
+ignored = ['CATALOG_NAME','CHECKIMAGE_NAME','CHECKIMAGE_TYPE','VERBOSE_TYPE',
+           'XML_NAME','WRITE_XML','NTHREADS','MEMORY_BUFSIZE',
+           'MEMORY_OBJSTACK','MEMORY_PIXSTACK']
+# Settings that name input files, whose contents matter rather than names
+filesettings = ['PARAMETERS_NAME','FILTER_NAME','STARNNW_NAME']
+
+########################## FUNCTIONS ###########################
+
+def readconfig(fname):
+    """
+    Reads the settings in a SExtractor configuration file
+
+    fname:      name of configuration file
+
+    Returns a dictionary of setting names and values as strings
+    """
+    settings = {}
+    with open(fname) as fobj:
+        for line in fobj:
+            line = line.split('#')[0].strip()
+            if line == '':
+                continue
+            words = line.split(None,1)
+            settings[words[0].upper()] = words[1].strip() if len(words) > 1 else ''
+    return settings
+
+########################## CLASSES ###########################
+
+class SExtractorManager(object):
+    """
+    Runs SExtractor through a cache of catalogues and check images
+
+    directory:  cache directory, created if missing - if None, use
+                sexcache from correlate_config (kwarg, default = None)
+    maxbytes:   maximum size of the cache in bytes - if None, use
+                sexcachesize (in GB) from correlate_config
+                (kwarg, default = None)
+    """
+    def __init__(self,directory=None,maxbytes=None):
+        if directory == None:
+            directory = config_data['sexcache']
+        if maxbytes == None:
+            maxbytes = config_data['sexcachesize']*2**30
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.runs = 0
+        self.hits = 0
+        # (path, size, mtime) -> SHA1 of file contents
+        self.checksums = {}
+        # Runs of the same key wait for each other, other runs do not
+        self.lock = threading.Lock()
+        self.keylocks = {}
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process made it first
+                pass
+
+    def checksum(self,fname):
+        """
+        Returns the SHA1 checksum of a file, remembered until it changes
+        """
+        stat = os.stat(fname)
+        memo = (os.path.abspath(fname),stat.st_size,stat.st_mtime)
+        if memo not in self.checksums:
+            sha = hashlib.sha1()
+            with open(fname,'rb') as fobj:
+                for block in iter(lambda: fobj.read(2**20),b''):
+                    sha.update(block)
+            self.checksums[memo] = sha.hexdigest()
+        return self.checksums[memo]
+
+    def key(self,image,config,options):
+        """
+        Hashes an image and the settings that affect SExtractor's results
+
+        image:      name of image file
+        config:     name of configuration file
+        options:    dictionary of settings given on the command line
+
+        Returns a hex string
+        """
+        settings = readconfig(config)
+        settings.update(dict([(k.upper(),str(v)) for k,v in options.items()]))
+        sha = hashlib.sha1()
+        sha.update(self.checksum(image))
+        for name in sorted(settings):
+            if name in ignored:
+                continue
+            value = settings[name]
+            if name in filesettings and os.path.isfile(value):
+                value = self.checksum(value)
+            sha.update('%s=%s;' % (name,value))
+        return sha.hexdigest()
+
+    def run(self,image,catalog,config='default.sex',options={},
+            checkimages={},sex='sex',**tags):
+        """
+        Produces the catalogue and check images of an image, running
+            SExtractor only if no earlier run with the same image and
+            settings made all of them
+
+        image:          name of image file
+        catalog:        name under which to save the catalogue
+        config:         SExtractor configuration file
+                        (kwarg, default = 'default.sex')
+        options:        dictionary of settings to give on the command line,
+                        overriding config (kwarg, default = {})
+        checkimages:    dictionary of check image types, e.g. OBJECTS,
+                        BACKGROUND or MINIBACKGROUND, and the names under
+                        which to save them (kwarg, default = {})
+        sex:            SExtractor executable (kwarg, default = 'sex')
+        tags:           further keyword arguments saved with the timing
+                        span of the run
+
+        Returns catalog
+        """
+        key = self.key(image,config,options)
+        entry = os.path.join(self.directory,key)
+        cached = os.path.join(entry,'catalog')
+        with self.lock:
+            keylock = self.keylocks.setdefault(key,threading.Lock())
+        with keylock:
+            have = []
+            if os.path.isdir(entry):
+                have = [f.split('.fits')[0] for f in os.listdir(entry)
+                        if f.endswith('.fits') and not f.startswith('.')]
+            if os.path.isfile(cached) and set(checkimages) <= set(have):
+                self.hits += 1
+                os.utime(entry,None)
+            else:
+                self._run(image,entry,config,options,
+                          sorted(set(checkimages) | set(have)),sex,tags)
+        self._copy(cached,catalog)
+        for checktype,fname in checkimages.items():
+            self._copy(os.path.join(entry,checktype+'.fits'),fname)
+        return catalog
+
+    def _run(self,image,entry,config,options,checktypes,sex,tags):
+        """
+        Runs SExtractor once, saving the catalogue and check images of
+            checktypes in the cache entry
+        """
+        if not os.path.isdir(entry):
+            os.makedirs(entry)
+        part = os.path.join(entry,'.%d' % os.getpid())
+        command = sex+' -c '+config+' -CATALOG_NAME '+part+'.catalog'
+        for name,value in options.items():
+            command += ' -'+name.upper()+' '+str(value)
+        if checktypes != []:
+            command += ' -CHECKIMAGE_TYPE '+','.join(checktypes)
+            command += ' -CHECKIMAGE_NAME '+','.join([part+'.'+t+'.fits'
+                                                      for t in checktypes])
+        else:
+            command += ' -CHECKIMAGE_TYPE NONE'
+        runtool(command+' '+image,**tags)
+        self.runs += 1
+        # Move the results into the entry, so it is never seen half made
+        for checktype in checktypes:
+            if os.path.isfile(part+'.'+checktype+'.fits'):
+                os.rename(part+'.'+checktype+'.fits',
+                          os.path.join(entry,checktype+'.fits'))
+        if os.path.isfile(part+'.catalog'):
+            os.rename(part+'.catalog',os.path.join(entry,'catalog'))
+        self.evict()
+
+    def _copy(self,src,dest):
+        """
+        Copies a cached result to dest, replacing dest atomically
+        """
+        if not os.path.isfile(src):
+            return
+        part = partname(dest)
+        shutil.copyfile(src,part)
+        os.rename(part,dest)
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache fits in
+            maxbytes
+
+        Returns nothing explicitly
+        """
+        entries = []
+        total = 0
+        for key in os.listdir(self.directory):
+            entry = os.path.join(self.directory,key)
+            try:
+                size = sum([os.path.getsize(os.path.join(entry,f))
+                            for f in os.listdir(entry)])
+                entries.append((os.path.getmtime(entry),size,entry))
+            except OSError:
+                continue
+            total += size
+        entries.sort()
+        while total > self.maxbytes and len(entries) > 1:
+            used,size,entry = entries.pop(0)
+            shutil.rmtree(entry,ignore_errors=True)
+            total -= size
+
+# Manager shared by every SExtractor call in this process
+manager = []
+
+def runsex(image,catalog,**kwd):
+    """
+    Runs SExtractor through this process's SExtractorManager - see
+        SExtractorManager.run for the arguments
+
+    Returns catalog
+    """
+    if manager == []:
+        manager.append(SExtractorManager())
+    return manager[0].run(image,catalog,**kwd)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""
+testpipeline - runs a small pipeline twice in a temporary directory and
+    checks that a cached stage whose input was changed in memory by an
+    upstream stage is run again, even while that input is still being written
+
+Requires the following modules: os, time, shutil, tempfile, numpy
+Requires the following files:   pipeline.py, artifactcache.py,
+                                artifactstore.py, frameio.py
+
+Contains the following functions: runpipeline, testkeyedinput
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+from pipeline import Scheduler
+from artifactcache import ArtifactCache
+from artifactstore import ArtifactStore
+
+########################## FUNCTIONS ###########################
+
+def runpipeline(directory,value,delay=0):
+    """
+    Runs an upstream stage that puts an image of value in the store and a
+        cached stage that doubles it
+
+    directory:  directory holding the files and the cache
+    value:      value of every pixel of the upstream image
+    delay:      seconds for which the store's writer is kept busy before the
+                upstream image is written (kwarg, default = 0)
+
+    Returns the Scheduler, after it has run
+    """
+    infile = os.path.join(directory,'in.fits')
+    outfile = os.path.join(directory,'out.fits')
+    cache = ArtifactCache(os.path.join(directory,'cache'))
+    store = ArtifactStore()
+    sched = Scheduler(cache=cache,store=store)
+
+    def make(results):
+        if delay:
+            # Queue the write behind a slow one, so it is still pending
+            # when the next stage starts
+            store.pool.apply_async(time.sleep,(delay,))
+        store.put(infile,np.zeros((4,4))+value)
+
+    def double(results):
+        data,header = store.get(infile)
+        store.put(outfile,2*data)
+
+    sched.add('make',make,outputs=[infile],force=True)
+    sched.add('double',double,inputs=[infile],outputs=[outfile],
+              params=lambda results: {'stage':'double'},inmemory=True)
+    try:
+        sched.run()
+    finally:
+        store.close()
+        cache.close()
+    return sched
+
+def testkeyedinput():
+    """
+    Changes the upstream image between two runs and checks that the cached
+        stage reruns and writes the doubled new image
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        sched = runpipeline(directory,1.)
+        assert sched.status['double'] == 'ran',sched.status
+        sched = runpipeline(directory,2.,delay=1)
+        assert sched.status['double'] == 'ran',sched.status
+        store = ArtifactStore()
+        data,header = store.get(os.path.join(directory,'out.fits'))
+        store.close()
+        assert (data == 4.).all(),data
+        print 'Reran a cached stage whose input was still being written'
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    testkeyedinput()
+    print 'Pipeline OK'
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+testworkqueue - runs several work queue workers on this machine against a
+    temporary directory, and checks that every task is done exactly once and
+    that the task of a killed worker is given to another
+
+Requires the following modules: os, time, shutil, signal, tempfile,
+                                multiprocessing, docopt
+Requires the following files:   workqueue.py
+
+Contains the following functions: dotask, hangtask, runworker, checkqueue,
+                                  testshare, testrequeue
+
+Usage:
+testworkqueue [-h] [-n TASKS] [-w WORKERS]
+
+Options:
+    -h, --help
+    -n TASKS, --tasks TASKS         Number of tasks to share out
+                                    [default: 20]
+    -w WORKERS, --workers WORKERS   Number of worker processes
+                                    [default: 4]
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import time
+import shutil
+import signal
+import tempfile
+import docopt
+from multiprocessing import Process
+from workqueue import WorkQueue
+
+########################## DATA LISTS ###########################
+
+# Short heartbeats, so a dead worker's claim goes stale within seconds
+timeout = 2
+interval = 0.2
+
+########################## FUNCTIONS ###########################
+
+def dotask(task):
+    """
+    Records that a task ran by appending its name to the test's log
+    """
+    time.sleep(0.05)
+    with open(task['log'],'a') as fobj:
+        fobj.write(task['name']+'\n')
+
+def hangtask(task):
+    """
+    Tells the test which task was claimed, then never finishes
+    """
+    with open(task['log']+'.hung','w') as fobj:
+        fobj.write(task['name'])
+    time.sleep(3600)
+
+def runworker(directory,function):
+    """
+    Processes tasks from the queue in directory until it is empty
+    """
+    WorkQueue(directory,timeout=timeout,interval=interval).work(function)
+
+def checkqueue(directory,names,log):
+    """
+    Asserts that every task is in done/ and ran exactly once, and that no
+        task is left in any other state
+    """
+    queue = WorkQueue(directory,timeout=timeout,interval=interval)
+    counts = queue.counts()
+    assert counts == {'pending':0,'claimed':0,'done':len(names),'failed':0},\
+           counts
+    done = sorted([f[:-len('.json')] for f in
+                   os.listdir(os.path.join(directory,'done'))])
+    assert done == sorted(names),done
+    with open(log) as fobj:
+        ran = sorted(fobj.read().split())
+    assert ran == sorted(names),ran
+
+def testshare(ntasks,nworkers):
+    """
+    Shares ntasks tasks between nworkers workers
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        log = os.path.join(directory,'ran.log')
+        queue = WorkQueue(directory,timeout=timeout,interval=interval)
+        names = ['task%03d' % i for i in range(ntasks)]
+        for name in names:
+            queue.enqueue({'name':name,'log':log},name)
+        workers = [Process(target=runworker,args=(directory,dotask))
+                   for i in range(nworkers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+        checkqueue(directory,names,log)
+        print 'Shared {0} tasks between {1} workers'.format(ntasks,nworkers)
+    finally:
+        shutil.rmtree(directory)
+
+def testrequeue(ntasks):
+    """
+    Kills a worker in the middle of a task, then checks that another worker
+        takes over its claim once the heartbeat goes stale
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        log = os.path.join(directory,'ran.log')
+        queue = WorkQueue(directory,timeout=timeout,interval=interval)
+        names = ['task%03d' % i for i in range(ntasks)]
+        for name in names:
+            queue.enqueue({'name':name,'log':log},name)
+        hung = Process(target=runworker,args=(directory,hangtask))
+        hung.start()
+        while not os.path.isfile(log+'.hung'):
+            time.sleep(interval)
+        with open(log+'.hung') as fobj:
+            claimed = fobj.read()
+        os.kill(hung.pid,signal.SIGKILL)
+        hung.join()
+        assert queue.counts()['claimed'] == 1
+        start = time.time()
+        worker = Process(target=runworker,args=(directory,dotask))
+        worker.start()
+        worker.join()
+        assert worker.exitcode == 0
+        assert time.time()-start >= timeout-interval
+        checkqueue(directory,names,log)
+        print 'Requeued {0} after its worker was killed'.format(claimed)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    arguments = docopt.docopt(__doc__)
+    ntasks = int(arguments['--tasks'])
+    nworkers = int(arguments['--workers'])
+    testshare(ntasks,nworkers)
+    testrequeue(ntasks)
+    print 'Work queue OK'
@@ -0,0 +1,260 @@
+"""
+timing - contains functions to time pipeline stages and external tool calls
+    as named spans, and to export them as a Chrome trace and a summary
+
+Each span records its start, wall time and CPU time, the process and thread
+it ran in, and tags such as the frame name and Herschel band. CPU time is
+that of the whole process plus the external programs it waited for during
+the span, so spans that overlap in threads share their CPU time.
+
+Each process saves its spans to its own file in a directory per run, named
+by the TRACE_RUN environment variable so that helper scripts started by
+correlate add their spans to the same run. The files of a run are merged
+into a single trace that can be opened in chrome://tracing or Perfetto.
+
+Requires the following modules: os, sys, json, glob, time, atexit,
+                                resource, threading, contextlib
+Requires the following files:   correlate_config.py
+
+Contains the following functions: runid, span, toolname, clear, savetrace,
+                                  loadtraces, writetrace, summarize,
+                                  printsummary, meancosts, printestimate
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import sys
+import json
+import glob
+import time
+import atexit
+import resource
+import threading
+from contextlib import contextmanager
+from correlate_config import *
+
+########################## DATA LISTS ###########################
+
+# Spans recorded in this process, as Chrome trace events
+spans = []
+spanlock = threading.Lock()
+# Number of trace files saved by this process
+saved = [0]
+
+# Name of the current run, shared with helper scripts started from here
+if 'TRACE_RUN' not in os.environ:
+    os.environ['TRACE_RUN'] = time.strftime('%Y%m%d-%H%M%S')+'-%d' % os.getpid()
+
+########################## FUNCTIONS ###########################
+
+def runid():
+    """
+    Returns the name of the current run
+    """
+    return os.environ['TRACE_RUN']
+
+def cputime():
+    """
+    Returns the CPU seconds used by this process and its waited-for children
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime+own.ru_stime+children.ru_utime+children.ru_stime
+
+@contextmanager
+def span(name,cat='stage',**tags):
+    """
+    Times the enclosed block
+
+    name:       name of the span, e.g. the stage or tool name, used to
+                group spans in the summary
+    cat:        category of the span, e.g. 'stage', 'tool' or 'script'
+                (kwarg, default = 'stage')
+    tags:       further keyword arguments, e.g. frame and band, saved with
+                the span
+
+    Returns nothing explicitly
+    """
+    start = time.time()
+    cpustart = cputime()
+    try:
+        yield
+    finally:
+        end = time.time()
+        args = dict([(k,str(v)) for k,v in tags.items()])
+        args['cpu'] = cputime()-cpustart
+        event = {'name':name,'cat':cat,'ph':'X','ts':start*1e6,
+                 'dur':(end-start)*1e6,'pid':os.getpid(),
+                 'tid':threading.current_thread().ident,'args':args}
+        with spanlock:
+            spans.append(event)
+
+def toolname(command):
+    """
+    Returns the name of the program a shell command runs, used to name its
+        span
+    """
+    words = command.split()
+    tool = os.path.basename(words[0])
+    # Name helper scripts rather than the interpreter
+    if tool.startswith('python') and len(words) > 1:
+        tool = os.path.basename(words[1])
+    return tool
+
+def clear():
+    """
+    Forgets the spans recorded so far in this process, e.g. those inherited
+        by a forked worker
+    """
+    with spanlock:
+        del spans[:]
+
+def savetrace(directory=None):
+    """
+    Saves the spans recorded so far in this process to a file of their own
+        in the run's trace directory, then forgets them
+
+    directory:  directory holding one subdirectory of traces per run - if
+                None, use tracedir from correlate_config, and if that is
+                empty do not save (kwarg, default = None)
+
+    Returns the path of the saved file, or None if nothing was saved
+    """
+    if directory == None:
+        directory = config_data['tracedir']
+    with spanlock:
+        if not directory or spans == []:
+            return None
+        events = list(spans)
+        del spans[:]
+    rundir = os.path.join(directory,runid())
+    if not os.path.isdir(rundir):
+        try:
+            os.makedirs(rundir)
+        except OSError:
+            # Another process made it first
+            pass
+    prog = os.path.basename(sys.argv[0]) or 'python'
+    fname = os.path.join(rundir,'%s.%d.%d.json' % (prog,os.getpid(),saved[0]))
+    saved[0] += 1
+    with open(fname,'w') as fobj:
+        json.dump(events,fobj)
+    return fname
+
+def loadtraces(directory=None,run=None):
+    """
+    Reads the spans saved by every process of a run
+
+    directory:  trace directory - if None, use tracedir from
+                correlate_config (kwarg, default = None)
+    run:        name of the run - if None, the current run, and if '*',
+                every run in the directory (kwarg, default = None)
+
+    Returns a list of trace events
+    """
+    if directory == None:
+        directory = config_data['tracedir']
+    if run == None:
+        run = runid()
+    events = []
+    for fname in sorted(glob.glob(os.path.join(directory,run,'*.json'))):
+        with open(fname) as fobj:
+            events += json.load(fobj)
+    return events
+
+def writetrace(fname,events):
+    """
+    Saves trace events in the Chrome trace event format
+
+    fname:      name of file to save
+    events:     list of trace events, as returned by loadtraces
+
+    Returns nothing explicitly, implicitly saves fname
+    """
+    with open(fname,'w') as fobj:
+        json.dump({'traceEvents':events,'displayTimeUnit':'ms'},fobj)
+
+def summarize(events):
+    """
+    Totals trace events by category and name
+
+    events:     list of trace events
+
+    Returns a list of (category, name, count, total wall seconds, mean
+    wall seconds, total CPU seconds) tuples, slowest first
+    """
+    totals = {}
+    for event in events:
+        key = (event['cat'],event['name'])
+        count,wall,cpu = totals.get(key,(0,0.,0.))
+        totals[key] = (count+1,wall+event['dur']/1e6,
+                       cpu+event['args'].get('cpu',0.))
+    rows = [(cat,name,count,wall,wall/count,cpu)
+            for (cat,name),(count,wall,cpu) in totals.items()]
+    rows.sort(key=lambda row: row[3],reverse=True)
+    return rows
+
+def printsummary(events):
+    """
+    Prints a table of the time spent in each kind of span
+
+    events:     list of trace events
+
+    Returns nothing explicitly
+    """
+    print '%-8s %-32s %7s %11s %10s %11s' % ('Category','Name','Count',
+                                            'Wall [s]','Mean [s]','CPU [s]')
+    for cat,name,count,wall,mean,cpu in summarize(events):
+        print '%-8s %-32s %7d %11.1f %10.2f %11.1f' % (cat,name[:32],count,
+                                                      wall,mean,cpu)
+
+def meancosts(events,cat='stage'):
+    """
+    Averages the time taken by each kind of span, e.g. to estimate the cost
+        of a future run from the traces of earlier ones
+
+    events:     list of trace events
+    cat:        category of spans to average (kwarg, default = 'stage')
+
+    Returns a dictionary of span names and (count, mean wall seconds, mean
+    CPU seconds) tuples
+    """
+    return dict([(name,(count,mean,cpu/count))
+                 for c,name,count,wall,mean,cpu in summarize(events)
+                 if c == cat])
+
+def printestimate(counts,events):
+    """
+    Prints a table of the expected cost of running stages, from the mean
+        cost of the same stages in earlier runs
+
+    counts:     dictionary of stage names and the number of times each
+                would run
+    events:     list of trace events of earlier runs
+
+    Returns the estimated total CPU hours, counting only stages with history
+    """
+    costs = meancosts(events)
+    print '%-24s %7s %9s %10s %10s %9s' % ('Stage','Runs','History',
+                                          'Wall [s]','CPU [s]','CPU [h]')
+    total = 0.
+    # Most expensive first, then stages without history
+    order = sorted(counts,key=lambda n: -costs.get(n,(0,0.,0.))[2]*counts[n])
+    for name in order:
+        if name not in costs:
+            print '%-24s %7d %9s %10s %10s %9s' % (name[:24],counts[name],0,
+                                                  'n/a','n/a','n/a')
+            continue
+        seen,wall,cpu = costs[name]
+        hours = counts[name]*cpu/3600.
+        total += hours
+        print '%-24s %7d %9d %10.2f %10.2f %9.2f' % (name[:24],counts[name],
+                                                    seen,wall,cpu,hours)
+    print '%-24s %7d %9s %10s %10s %9.2f' % ('Total',sum(counts.values()),
+                                            '','','',total)
+    return total
+
+# Save whatever was not saved explicitly when the process exits normally
+atexit.register(savetrace)
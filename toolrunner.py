@@ -0,0 +1,164 @@
+"""
+toolrunner - contains functions to run external programs such as
+    solve-field, SExtractor, SCAMP and SWarp with a bounded number of runs of
+    each program at once, saving their output to a log for each frame
+
+Each program has its own pool of slots, sized by toolslots in
+correlate_config, and a run waits for a free slot of its program before it
+starts, so that e.g. a few memory hungry SWarp runs can overlap with many
+SExtractor runs. Runs started with start wait for their program in a thread
+of their own and return at once, so that they overlap with each other and
+with numpy work in the calling thread. Slots are shared by every thread of a
+process, not between processes.
+
+The standard output and error of each run are collected and appended to
+<toollogs>/<run>/<frame>.log in one piece, so runs for the same frame in
+different threads do not interleave their output. Each run is timed as a
+span in the 'tool' category of timing.py.
+
+Requires the following modules: os, time, threading, subprocess,
+                                multiprocessing
+Requires the following files:   correlate_config.py, timing.py
+
+Contains the following functions: slot, logname, runtool, start, waitall
+
+Contains the following classes: ToolRun
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import time
+import threading
+import subprocess
+from multiprocessing import cpu_count
+from correlate_config import *
+from timing import span, toolname, runid
+
+########################## DATA LISTS ###########################
+
+# Semaphore limiting the concurrent runs of each program in this process
+slots = {}
+slotlock = threading.Lock()
+# Held while appending to a log, one lock per log file
+loglocks = {}
+
+########################## FUNCTIONS ###########################
+
+def slot(tool):
+    """
+    Returns the semaphore of a program, made on first use with the number
+        of slots given in toolslots, or one per CPU if it is not listed
+    """
+    with slotlock:
+        if tool not in slots:
+            size = config_data['toolslots'].get(tool,cpu_count())
+            slots[tool] = threading.BoundedSemaphore(max(int(size),1))
+        return slots[tool]
+
+def logname(tool,frame=None):
+    """
+    Returns the name of the log for a run, or None if logging is off
+
+    tool:       name of the program
+    frame:      name of the frame the run is for - if None, log to a file
+                named after the program (kwarg, default = None)
+    """
+    if not config_data['toollogs']:
+        return None
+    name = os.path.basename(str(frame)) if frame != None else tool
+    return os.path.join(config_data['toollogs'],runid(),name+'.log')
+
+def _savelog(fname,command,status,output):
+    """
+    Appends the output of one run to a log
+    """
+    directory = os.path.dirname(fname)
+    with slotlock:
+        lock = loglocks.setdefault(fname,threading.Lock())
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    with lock:
+        with open(fname,'a') as fobj:
+            fobj.write('### {0} {1}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S'),
+                                              command))
+            fobj.write(output)
+            fobj.write('### exit status {0}\n'.format(status))
+
+def runtool(command,**tags):
+    """
+    Runs a shell command once a slot of its program is free, and waits for
+        it to finish
+
+    command:    shell command
+    tags:       further keyword arguments saved with the timing span, e.g.
+                frame, which also names the log
+
+    Returns the exit status of the command
+    """
+    tool = toolname(command)
+    log = logname(tool,tags.get('frame'))
+    queued = time.time()
+    with slot(tool):
+        tags['slotwait'] = '%.2f' % (time.time()-queued)
+        with span(tool,cat='tool',command=command,**tags):
+            if log == None:
+                return subprocess.call(command,shell=True)
+            proc = subprocess.Popen(command,shell=True,stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            output = proc.communicate()[0]
+    _savelog(log,command,proc.returncode,output)
+    return proc.returncode
+
+def start(command,**tags):
+    """
+    Starts runtool in a thread of its own - see runtool for the arguments
+
+    Returns a ToolRun whose wait method returns the exit status
+    """
+    run = ToolRun(command,tags)
+    run.start()
+    return run
+
+def waitall(runs):
+    """
+    Waits for every run in a list of ToolRuns
+
+    Returns a list of their exit statuses
+    """
+    return [run.wait() for run in runs]
+
+########################## CLASSES ###########################
+
+class ToolRun(threading.Thread):
+    """
+    A run of an external program in a thread of its own
+
+    command:    shell command
+    tags:       dictionary of keyword arguments for runtool
+    """
+    def __init__(self,command,tags):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.command = command
+        self.tags = tags
+        self.status = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.status = runtool(self.command,**self.tags)
+        except Exception as error:
+            self.error = error
+
+    def wait(self):
+        """
+        Waits for the run to finish, raising any error it raised
+
+        Returns the exit status of the command
+        """
+        self.join()
+        if self.error != None:
+            raise self.error
+        return self.status
@@ -0,0 +1,225 @@
+"""
+workqueue - contains a class to share tasks between worker processes on
+    any number of machines through a directory on shared storage
+
+Each task is a JSON file. It waits in pending/, and a worker claims it by
+renaming it into claimed/, which succeeds for exactly one worker. While a
+worker processes a task it touches the claimed file regularly as a
+heartbeat. Claimed tasks whose heartbeat stops, e.g. because their worker
+died, are renamed back into pending/ by any other worker. Finished tasks
+are moved to done/, and tasks that raised an error to failed/.
+
+Several workers on one machine can share a queue in a temporary directory,
+which is an easy way to try the queue out, as testworkqueue.py does.
+
+Requires the following modules: os, json, time, socket, threading,
+                                traceback
+
+Contains the following classes: Heartbeat, WorkQueue
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import json
+import time
+import socket
+import threading
+import traceback
+
+########################## DATA LISTS ###########################
+
+# Subdirectories of a queue, one for each task state
+states = ['pending','claimed','done','failed']
+
+########################## CLASSES ###########################
+
+class Heartbeat(threading.Thread):
+    """
+    Touches a claimed task file every interval seconds until stopped or
+        until the file disappears
+
+    fname:      path to the claimed task file
+    interval:   seconds between touches
+    """
+    def __init__(self,fname,interval):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.fname = fname
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                os.utime(self.fname,None)
+            except OSError:
+                # The task was requeued or finished elsewhere
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+class WorkQueue(object):
+    """
+    A queue of tasks kept as files in a directory
+
+    directory:  queue directory, created if missing
+    timeout:    seconds after the last heartbeat before a claimed task is
+                requeued (kwarg, default = 600)
+    interval:   seconds between heartbeats and between polls of an empty
+                queue (kwarg, default = 30)
+    """
+    def __init__(self,directory,timeout=600,interval=30):
+        self.directory = directory
+        self.timeout = timeout
+        self.interval = interval
+        self.worker = '%s.%d' % (socket.gethostname(),os.getpid())
+        self.heartbeats = {}
+        for state in states:
+            path = os.path.join(directory,state)
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # Another process made it first
+                    pass
+
+    def _path(self,state,name):
+        """
+        Returns the path of task name in state
+        """
+        return os.path.join(self.directory,state,name+'.json')
+
+    def enqueue(self,task,name):
+        """
+        Adds a task to the queue
+
+        task:       JSON serializable description of the task
+        name:       unique name of the task, used as its file name
+
+        Returns nothing explicitly
+        """
+        name = name.replace(os.sep,'_')
+        # Write beside the queue and rename, so no worker sees a partial task
+        tmp = os.path.join(self.directory,'.'+name+'.%s.tmp' % self.worker)
+        with open(tmp,'w') as fobj:
+            json.dump(task,fobj)
+        os.rename(tmp,self._path('pending',name))
+
+    def claim(self):
+        """
+        Claims the first pending task and starts its heartbeat
+
+        Returns the name and task, or None if no task could be claimed
+        """
+        for fname in sorted(os.listdir(os.path.join(self.directory,
+                                                    'pending'))):
+            if not fname.endswith('.json'):
+                continue
+            name = fname[:-len('.json')]
+            claimed = self._path('claimed',name)
+            try:
+                os.rename(self._path('pending',name),claimed)
+            except OSError:
+                # Another worker claimed it first
+                continue
+            # Mark the claim as fresh, as rename keeps the old mtime
+            os.utime(claimed,None)
+            with open(claimed) as fobj:
+                task = json.load(fobj)
+            heartbeat = Heartbeat(claimed,self.interval)
+            heartbeat.start()
+            self.heartbeats[name] = heartbeat
+            return name,task
+        return None
+
+    def _finish(self,name,state):
+        """
+        Stops the heartbeat of a claimed task and moves it to state
+        """
+        heartbeat = self.heartbeats.pop(name,None)
+        if heartbeat != None:
+            heartbeat.stop()
+        try:
+            os.rename(self._path('claimed',name),self._path(state,name))
+        except OSError:
+            print 'Task '+name+' was requeued while it was being processed'
+
+    def complete(self,name):
+        """
+        Marks a claimed task as done
+        """
+        self._finish(name,'done')
+
+    def fail(self,name,error=''):
+        """
+        Marks a claimed task as failed, saving error beside it
+        """
+        with open(self._path('failed',name)[:-len('.json')]+'.err','w') as fobj:
+            fobj.write(self.worker+'\n'+error)
+        self._finish(name,'failed')
+
+    def requeue(self):
+        """
+        Moves claimed tasks whose heartbeat is older than timeout back to
+            pending
+
+        Returns the number of tasks requeued
+        """
+        requeued = 0
+        now = time.time()
+        for fname in os.listdir(os.path.join(self.directory,'claimed')):
+            name = fname[:-len('.json')]
+            path = self._path('claimed',name)
+            try:
+                if now-os.path.getmtime(path) < self.timeout:
+                    continue
+                os.rename(path,self._path('pending',name))
+                requeued += 1
+            except OSError:
+                # Finished or requeued by someone else meanwhile
+                continue
+        return requeued
+
+    def counts(self):
+        """
+        Returns a dictionary of the number of tasks in each state
+        """
+        return dict([(state,len([f for f in os.listdir(os.path.join(
+                         self.directory,state)) if f.endswith('.json')]))
+                     for state in states])
+
+    def work(self,function,verbose=False):
+        """
+        Claims and processes tasks until none are pending or claimed by
+            other workers. Stale claims are requeued while waiting.
+
+        function:   function called with each task
+        verbose:    if True, print each task (kwarg, default = False)
+
+        Returns the number of tasks this worker completed
+        """
+        completed = 0
+        while True:
+            self.requeue()
+            claimed = self.claim()
+            if claimed == None:
+                if self.counts()['claimed'] == 0:
+                    return completed
+                # Others are still working and may die, so keep watching
+                time.sleep(self.interval)
+                continue
+            name,task = claimed
+            if verbose:
+                print self.worker+' claimed '+name
+            try:
+                function(task)
+            except Exception:
+                traceback.print_exc()
+                self.fail(name,traceback.format_exc())
+                continue
+            self.complete(name)
+            completed += 1
@@ -0,0 +1,75 @@
+"""
+workspace - contains functions to give each worker its own scratch
+    directory and to move finished files into place atomically
+
+External tools and helper scripts write intermediate files (catalogues,
+configuration files, coadds) under fixed names. Giving each worker a
+private workspace lets several frames be processed at once, and publishing
+results by rename means a reader never sees a half written file.
+
+Requires the following modules: os, shutil, tempfile
+
+Contains the following functions: makeworkspace, removeworkspace,
+                                  partname, publish
+
+"""
+
+########################## IMPORT PACKAGES ###########################
+
+import os
+import shutil
+import tempfile
+
+########################## FUNCTIONS ###########################
+
+def makeworkspace(parent=None):
+    """
+    Creates an empty scratch directory
+
+    parent:     directory in which to create the workspace - if None or
+                empty, use the system temporary directory
+                (kwarg, default = None)
+
+    Returns the absolute path of the workspace
+    """
+    if parent:
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        return os.path.abspath(tempfile.mkdtemp(prefix='ws_',dir=parent))
+    return os.path.abspath(tempfile.mkdtemp(prefix='ws_'))
+
+def removeworkspace(workspace):
+    """
+    Deletes a scratch directory and everything in it
+
+    workspace:  path returned by makeworkspace
+
+    Returns nothing explicitly
+    """
+    shutil.rmtree(workspace,ignore_errors=True)
+
+def partname(dest):
+    """
+    Names a hidden file next to dest in which to write dest before it is
+        renamed into place
+
+    dest:       final path
+
+    Returns path to the partial file
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(dest)),
+                        '.'+os.path.basename(dest)+'.%d.part' % os.getpid())
+
+def publish(src,dest):
+    """
+    Moves src to dest so that dest appears complete or not at all. If src
+        is on another file system it is first copied next to dest.
+
+    src:        path to finished file, usually in a workspace
+    dest:       final path
+
+    Returns nothing explicitly, implicitly moves src
+    """
+    tmp = partname(dest)
+    shutil.move(src,tmp)
+    os.rename(tmp,dest)